@@ -0,0 +1,284 @@
+import cv2
+import json
+import time
+import logging
+import argparse
+import platform
+import tempfile
+import numpy as np
+from pathlib import Path
+from datetime import datetime, timezone
+
+from cv import (
+    analyse_frame,
+    analyse_frames,
+    convert_to_midi,
+    extract_frames,
+    get_color_ranges,
+    get_key_count,
+    get_key_dict,
+    get_key_region,
+    get_note_events,
+    get_sample_points,
+    prepare_keys,
+    probe_frame,
+    search_keys,
+)
+from profiling import get_peak_rss
+from source import FrameSource
+from synth import (
+    BACKGROUND_COLOR,
+    BLACK_COLOR,
+    PRESSED_COLOR,
+    WHITE_COLOR,
+    get_synth_settings,
+    render_video,
+    write_truth,
+)
+
+BENCH_SETTINGS = {
+    "white_color": (255, 255, 255),
+    "black_color": (0, 0, 0),
+    "pressed_color": (128, 128, 128),
+    "white_threshold": 0.25,
+    "black_threshold": 0.5,
+    "pressed_threshold": 0.55,
+    "min_area_pixel": 500,
+    "min_area_percent": 0.45,
+    "midi_velocity": 64,
+    "note_offset": 21,
+}
+
+
+def analyse_frame_loop(keys: dict[str, tuple[int, int, int, int]], frame: any, settings: dict[str, any]) -> dict[str, bool]:
+    """Reference per-key loop used before the vectorized occupancy engine."""
+    pressed = get_key_dict(False)
+    mask = cv2.inRange(
+        frame, *get_color_ranges(settings["pressed_color"], settings["pressed_threshold"]))
+    detected = cv2.bitwise_and(frame, frame, mask=mask)
+
+    # Loop over keys
+    for note, (x, y, w, h) in keys.items():
+        # Check if box is not a placeholder
+        if w * h > 0:
+            box = detected[y:y + h, x:x + w]
+            color = np.count_nonzero(box)
+
+            # Check if key is pressed
+            if color / (w * h) >= settings["min_area_percent"]:
+                pressed[note] = True
+
+    return pressed
+
+
+def make_keyboard(width: int, height: int, seed: int) -> tuple[dict[str, tuple[int, int, int, int]], any]:
+    """Build 88 side-by-side key boxes over a noisy band with random pressed coverage."""
+    rng = np.random.default_rng(seed)
+    frame = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    keys = get_key_dict(None)
+    key_width = width // len(keys)
+
+    # Loop over keys
+    for i, note in enumerate(keys.keys()):
+        keys[note] = (i * key_width, 0, key_width, height)
+        coverage = rng.random((height, key_width)) < rng.random()
+        frame[:, i * key_width:(i + 1) * key_width][coverage] = BENCH_SETTINGS["pressed_color"]
+
+    return keys, frame
+
+
+def time_call(func: callable, *args: any, repeat: int) -> float:
+    """Return the mean wall time of a call in seconds."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(*args)
+    return (time.perf_counter() - start) / repeat
+
+
+def bench_occupancy(args: argparse.Namespace) -> dict[str, any]:
+    """Compare the per-key loop with the vectorized occupancy engine on one frame."""
+    keys, frame = make_keyboard(args.width, args.height, args.seed)
+
+    # Both implementations must agree before timing them
+    if list(analyse_frame_loop(keys, frame, BENCH_SETTINGS).values()) != analyse_frame(keys, frame, BENCH_SETTINGS).tolist():
+        raise RuntimeError("Vectorized key states differ from the reference loop")
+
+    loop = time_call(analyse_frame_loop, keys, frame, BENCH_SETTINGS, repeat=args.repeat)
+    vectorized = time_call(analyse_frame, keys, frame, BENCH_SETTINGS, repeat=args.repeat)
+    logging.info(f"Loop: {loop * 1000:.3f} ms/frame")
+    logging.info(f"Vectorized: {vectorized * 1000:.3f} ms/frame")
+    logging.info(f"Speedup: {loop / vectorized:.2f}x")
+
+    # Sample points trade exactness for far fewer pixel reads
+    points = get_sample_points(keys)
+    probed = time_call(probe_frame, points, frame, BENCH_SETTINGS, repeat=args.repeat)
+    agreement = float(np.mean(probe_frame(points, frame, BENCH_SETTINGS) == analyse_frame(keys, frame, BENCH_SETTINGS)))
+    logging.info(f"Sample points: {probed * 1000:.3f} ms/frame ({points[0].size} pixels, "
+                 f"{agreement:.2%} agreement with full boxes)")
+    return {"loop": loop, "vectorized": vectorized, "speedup": loop / vectorized,
+            "probed": probed, "probe_agreement": agreement}
+
+
+def run_stage(results: dict[str, any], name: str, frames: int, func: callable, *args: any) -> any:
+    """Time one pipeline stage and record its throughput and memory high-water mark."""
+    start = time.perf_counter()
+    result = func(*args)
+    seconds = time.perf_counter() - start
+
+    results[name] = {"seconds": seconds, "fps": frames / seconds if seconds else None, "peak_rss_mb": get_peak_rss()}
+    logging.info(f"{name}: {seconds:.3f} s ({frames / seconds:.1f} frames/s), peak RSS {get_peak_rss():.0f} MB")
+    return result
+
+
+def get_notes(piece: np.ndarray) -> list[tuple[int, int, int]]:
+    """List the (key, onset, offset) notes of a key-state matrix."""
+    frames, keys, states = get_note_events(piece)
+    onsets = {}
+    notes = []
+
+    # Pair every release with the preceding press of the same key
+    for frame, key, state in zip(frames.tolist(), keys.tolist(), states.tolist()):
+        if state:
+            onsets[key] = frame
+        else:
+            notes.append((key, onsets.pop(key), frame))
+
+    # Notes still held at the end
+    notes += [(key, onset, len(piece)) for key, onset in onsets.items()]
+    return sorted(notes, key=lambda note: (note[1], note[0]))
+
+
+def compare_notes(truth: np.ndarray, piece: np.ndarray, tolerance: int) -> dict[str, float]:
+    """Match detected notes to ground-truth notes of the same key by onset within a frame tolerance."""
+    expected = get_notes(truth)
+    detected = get_notes(piece)
+    unmatched = {}
+    for key, onset, _ in detected:
+        unmatched.setdefault(key, []).append(onset)
+
+    matched = 0
+    errors = []
+
+    # Greedily take the closest detected onset of the same key
+    for key, onset, _ in expected:
+        candidates = unmatched.get(key, [])
+        if candidates:
+            closest = min(candidates, key=lambda candidate: abs(candidate - onset))
+            if abs(closest - onset) <= tolerance:
+                candidates.remove(closest)
+                errors.append(abs(closest - onset))
+                matched += 1
+
+    precision = matched / len(detected) if detected else 1.0
+    recall = matched / len(expected) if expected else 1.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {
+        "expected_notes": len(expected),
+        "detected_notes": len(detected),
+        "precision": precision,
+        "recall": recall,
+        "f1": f1,
+        "mean_onset_error_frames": float(np.mean(errors)) if errors else None,
+    }
+
+
+def bench_pipeline(args: argparse.Namespace) -> dict[str, any]:
+    """Render a synthetic video and time every pipeline stage against its ground truth."""
+    # Detection follows the rendered colors
+    colors = [tuple(args.white_color), tuple(args.black_color), tuple(args.pressed_color)]
+    settings = get_synth_settings(*colors)
+    stages = {}
+
+    with tempfile.TemporaryDirectory() as temp:
+        directory = Path(args.keep or temp)
+        directory.mkdir(parents=True, exist_ok=True)
+        video = directory / "synthetic.mp4"
+
+        truth = render_video(video, args.width, args.height, args.fps, args.duration, args.density, args.quality,
+                             args.seed, *colors, tuple(args.background_color))
+        write_truth(truth, args.fps, directory / "truth.mid", settings)
+
+        # Detect keys on the first frame, which has no notes
+        source = FrameSource(video)
+        frame = source[0]
+        source.release()
+        keys = run_stage(stages, "search_keys", 1, search_keys, frame, settings)
+        if get_key_count(keys) != 88:
+            raise RuntimeError(f"Found {get_key_count(keys)}/88 keys in the synthetic video")
+
+        region = get_key_region(keys, (args.width, args.height))
+        frames, props = run_stage(stages, "extract_frames", len(truth), extract_frames, video, None, region)
+        piece = run_stage(stages, "analyse_frames", len(frames), analyse_frames,
+                          prepare_keys(keys, region), frames, settings)
+        run_stage(stages, "convert_to_midi", len(piece), convert_to_midi,
+                  piece, props, directory / "detected.mid", settings)
+
+    length = min(len(truth), len(piece))
+    accuracy = compare_notes(truth[:length], piece[:length], args.tolerance)
+    logging.info(f"Notes: precision {accuracy['precision']:.3f}, recall {accuracy['recall']:.3f}, "
+                 f"F1 {accuracy['f1']:.3f}")
+
+    return {
+        "stages": stages,
+        "accuracy": accuracy,
+        "frames": len(truth),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Piano Syntheses benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    occupancy = commands.add_parser("occupancy", help="per-frame key occupancy microbenchmark")
+    occupancy.add_argument("--width", type=int, default=1920)
+    occupancy.add_argument("--height", type=int, default=200)
+    occupancy.add_argument("--repeat", type=int, default=200)
+    occupancy.add_argument("--seed", type=int, default=0)
+    occupancy.add_argument("--output", type=Path, help="save results as JSON")
+    occupancy.set_defaults(func=bench_occupancy)
+
+    pipeline = commands.add_parser("pipeline", help="per-stage benchmark on a synthetic video")
+    pipeline.add_argument("--width", type=int, default=1280)
+    pipeline.add_argument("--height", type=int, default=720)
+    pipeline.add_argument("--fps", type=float, default=30)
+    pipeline.add_argument("--duration", type=float, default=10, help="video length in seconds")
+    pipeline.add_argument("--density", type=float, default=4, help="notes per second")
+    pipeline.add_argument("--quality", type=int, help="JPEG quality for simulated compression noise")
+    pipeline.add_argument("--tolerance", type=int, default=1, help="onset tolerance in frames")
+    pipeline.add_argument("--seed", type=int, default=0)
+    pipeline.add_argument("--white-color", type=int, nargs=3, default=list(WHITE_COLOR), metavar=("B", "G", "R"),
+                          help="color of the white keys")
+    pipeline.add_argument("--black-color", type=int, nargs=3, default=list(BLACK_COLOR), metavar=("B", "G", "R"),
+                          help="color of the black keys")
+    pipeline.add_argument("--pressed-color", type=int, nargs=3, default=list(PRESSED_COLOR), metavar=("B", "G", "R"),
+                          help="color of pressed keys")
+    pipeline.add_argument("--background-color", type=int, nargs=3, default=list(BACKGROUND_COLOR),
+                          metavar=("B", "G", "R"), help="color of the background")
+    pipeline.add_argument("--keep", type=Path, help="keep the video and MIDI files in this directory")
+    pipeline.add_argument("--output", type=Path, default=Path(f"benchmark-{datetime.now():%Y%m%d-%H%M%S}.json"),
+                          help="save results as JSON")
+    pipeline.set_defaults(func=bench_pipeline)
+
+    args = parser.parse_args()
+    results = args.func(args)
+
+    # Store parameters and environment, so runs can be compared over time
+    if args.output:
+        params = {key: str(value) if isinstance(value, Path) else value
+                  for key, value in vars(args).items() if key not in ["func", "output"]}
+        record = {
+            "time": datetime.now(timezone.utc).isoformat(),
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "opencv": cv2.__version__,
+            "params": params,
+            "results": results,
+        }
+        with open(args.output, "w") as file:
+            json.dump(record, file, indent=4)
+        logging.info(f"Results saved to '{args.output}'")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
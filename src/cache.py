@@ -0,0 +1,158 @@
+import os
+import json
+import hashlib
+import logging
+import numpy as np
+from pathlib import Path
+from typing import Iterator
+
+from cv import get_frame_count, iter_frames
+
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "piano-syntheses"
+DEFAULT_CACHE_BYTES = 8 * 2 ** 30
+HASH_CHUNK = 2 ** 20
+
+
+def hash_file(path: Path) -> str:
+    """Hash the content of a file in chunks."""
+    digest = hashlib.sha256()
+
+    with open(path, "rb") as file:
+        while chunk := file.read(HASH_CHUNK):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def is_running(pid: int) -> bool:
+    """Check whether a process with this id still exists."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # Exists, but belongs to another user
+        return True
+    return True
+
+
+class DecodeCache:
+    """On-disk cache of decoded frames, memory-mapped on reuse and evicted least recently used first."""
+
+    def __init__(self, root: Path = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_CACHE_BYTES) -> None:
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.hashes = {}
+        os.makedirs(self.root, exist_ok=True)
+        self.remove_stale()
+
+    def get_key(self, path: Path, params: dict[str, any]) -> str:
+        """Combine the video content hash with the decode parameters."""
+        stat = os.stat(path)
+        file_id = (str(path), stat.st_size, stat.st_mtime_ns)
+
+        # Hash each file only once per process
+        if file_id not in self.hashes:
+            self.hashes[file_id] = hash_file(path)
+
+        params = json.dumps(params, sort_keys=True)
+        return hashlib.sha256((self.hashes[file_id] + params).encode()).hexdigest()
+
+    def load(self, key: str) -> np.memmap:
+        """Memory-map cached frames or return None if they are not cached."""
+        meta = self.root / f"{key}.json"
+        raw = self.root / f"{key}.raw"
+        if not meta.exists() or not raw.exists():
+            return None
+
+        with open(meta) as file:
+            info = json.load(file)
+
+        # Mark as recently used
+        os.utime(raw)
+        return np.memmap(raw, dtype=info["dtype"], mode="r", shape=tuple(info["shape"]))
+
+    def iter_frames(self, path: Path, region: tuple[int, int, int, int] = None, scale: float = 1) -> Iterator[any]:
+        """Yield frames from the cache, or decode them while writing them to the cache."""
+        key = self.get_key(path, {"region": region, "scale": scale})
+        frames = self.load(key)
+
+        if frames is not None:
+            logging.info(f"Decoded frames of '{os.path.basename(path)}' loaded from cache")
+            yield from frames
+            return
+
+        raw = self.root / f"{key}.raw"
+        # Unique per process, as several jobs may decode the same video
+        part = self.root / f"{key}.{os.getpid()}.part"
+        length = get_frame_count(path)
+        file = open(part, "wb")
+        limit = None
+        shape = None
+        count = 0
+
+        try:
+            for frame in iter_frames(path, region, scale):
+                size = max(length, count + 1) * frame.nbytes
+                # Make room for the whole decode once the frame size is known, unless it exceeds the whole cache
+                if file and limit is None:
+                    limit = self.max_bytes - self.evict(reserve=size) if size <= self.max_bytes else self.max_bytes
+                # Keep streaming without caching if the entry does not fit (the frame count can be an estimate)
+                if file and size > limit:
+                    file.close()
+                    file = None
+                    part.unlink()
+                    logging.info(f"Decoded frames of '{os.path.basename(path)}' not cached, they need about "
+                                 f"{size / 2 ** 30:.2f} GB of {limit / 2 ** 30:.2f} GB free cache space")
+                if file:
+                    file.write(np.ascontiguousarray(frame).data)
+                    shape = frame.shape
+                    count += 1
+                yield frame
+
+            # Only complete decodes are published
+            if file and shape is not None:
+                file.close()
+                file = None
+                os.replace(part, raw)
+                with open(self.root / f"{key}.json", "w") as meta:
+                    json.dump({"video": os.path.basename(path), "shape": [count, *shape], "dtype": "uint8"}, meta)
+                logging.info(f"Decoded frames of '{os.path.basename(path)}' cached ({count} frames)")
+                self.evict(keep=key)
+        finally:
+            if file:
+                file.close()
+            if part.exists():
+                part.unlink()
+
+    def remove_stale(self) -> None:
+        """Delete partial decodes left behind by processes that were killed before finishing."""
+        # Loop over partial files named {key}.{pid}.part
+        for part in self.root.glob("*.part"):
+            pid = part.suffixes[-2][1:] if len(part.suffixes) > 1 else ""
+            if pid.isdigit() and is_running(int(pid)):
+                continue
+
+            part.unlink(missing_ok=True)
+            logging.info(f"Stale partial cache file {part.name} removed")
+
+    def evict(self, keep: str = None, reserve: int = 0) -> int:
+        """Delete least recently used entries until the cache (including running partial decodes) leaves reserve bytes
+        below its size limit, and return the size of what is left."""
+        self.remove_stale()
+        entries = sorted(self.root.glob("*.raw"), key=lambda raw: raw.stat().st_mtime)
+        total = sum(raw.stat().st_size for raw in entries)
+        total += sum(part.stat().st_size for part in self.root.glob("*.part") if part.exists())
+
+        # Oldest first
+        for raw in entries:
+            if total + reserve <= self.max_bytes:
+                break
+            if raw.stem == keep:
+                continue
+
+            total -= raw.stat().st_size
+            raw.unlink()
+            (self.root / f"{raw.stem}.json").unlink(missing_ok=True)
+            logging.debug(f"Cache entry {raw.stem} evicted")
+
+        return total
@@ -0,0 +1,165 @@
+import os
+import cv2
+import json
+import logging
+import numpy as np
+from pathlib import Path
+from typing import Callable
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+
+from cv import find_key_rects, get_key_count, search_keys
+from cache import DEFAULT_CACHE_DIR, hash_file
+from source import FrameSource
+
+CANDIDATE_FRAMES = 8
+KEYBOARD_BAND = 0.3
+KMEANS_CLUSTERS = 4
+KMEANS_SAMPLES = 20000
+MIN_CHANNEL = 10
+WHITE_KEYS = 52
+BLACK_KEYS = 36
+WHITE_THRESHOLDS = [0.05, 0.1, 0.15, 0.2, 0.25, 0.3, 0.35, 0.4, 0.45, 0.5]
+BLACK_THRESHOLDS = [0.25, 0.5, 0.75, 1.0, 1.25, 1.5, 2.0, 2.5, 3.0, 4.0]
+CALIBRATED_KEYS = ["white_color", "black_color", "white_threshold", "black_threshold", "min_area_pixel"]
+
+
+def get_key_colors(frames: list[any]) -> tuple[tuple[int, int, int], tuple[int, int, int]]:
+    """Cluster the colors of the bottom band of the frames and return the brightest and darkest cluster (BGR)."""
+    pixels = np.concatenate([frame[int(frame.shape[0] * (1 - KEYBOARD_BAND)):].reshape(-1, 3) for frame in frames])
+
+    # A random subset is enough to find the dominant colors
+    rng = np.random.default_rng(0)
+    pixels = pixels[rng.choice(len(pixels), min(len(pixels), KMEANS_SAMPLES), replace=False)]
+
+    cv2.setRNGSeed(0)
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 1.0)
+    _, _, centers = cv2.kmeans(pixels.astype(np.float32), KMEANS_CLUSTERS, None, criteria, 3,
+                               cv2.KMEANS_PP_CENTERS)
+
+    brightness = centers.sum(axis=1)
+    white = tuple(int(round(c)) for c in centers[brightness.argmax()])
+    # Thresholds scale with the color, so channels near 0 would only ever match exactly
+    black = tuple(max(MIN_CHANNEL, int(round(c))) for c in centers[brightness.argmin()])
+    logging.debug(f"Key colors (BGR): white {white}, black {black}")
+    return white, black
+
+
+def get_rect_areas(frame: any, color: tuple[int, int, int], thresholds: list[float]) -> list[np.ndarray]:
+    """Return the bounding box areas of all contours per threshold, largest first."""
+    areas = []
+
+    # Loop over thresholds
+    for threshold in thresholds:
+        rects = find_key_rects(frame, color, threshold)
+        areas.append(np.sort(np.array([w * h for _, _, w, h in rects], dtype=np.int64))[::-1])
+
+    return areas
+
+
+def get_area_bounds(areas: np.ndarray, count: int) -> tuple[int, int]:
+    """Return the range [low, high) of minimum areas that keep exactly count boxes."""
+    if len(areas) < count:
+        return 0, 0
+
+    # Boxes are kept if their area is larger than the minimum
+    low = int(areas[count]) if len(areas) > count else 0
+    return low, int(areas[count - 1])
+
+
+def calibrate_frames(
+    frames: list[any],
+    workers: int = None,
+    check: Callable[[], None] = None,
+) -> tuple[dict[str, any], int]:
+    """Find key colors, thresholds and minimum area that detect 88 keys, plus the index of the frame they fit best."""
+    white, black = get_key_colors(frames)
+
+    # Contour areas only depend on one color and threshold, so both colors are searched independently
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        if check:
+            check()
+        whites = list(executor.map(get_rect_areas, frames, repeat(white), repeat(WHITE_THRESHOLDS)))
+        if check:
+            check()
+        blacks = list(executor.map(get_rect_areas, frames, repeat(black), repeat(BLACK_THRESHOLDS)))
+    if check:
+        check()
+
+    best = None
+
+    # Loop over frames and threshold pairs
+    for i in range(len(frames)):
+        for white_threshold, white_areas in zip(WHITE_THRESHOLDS, whites[i]):
+            white_low, white_high = get_area_bounds(white_areas, WHITE_KEYS)
+
+            for black_threshold, black_areas in zip(BLACK_THRESHOLDS, blacks[i]):
+                black_low, black_high = get_area_bounds(black_areas, BLACK_KEYS)
+                low, high = max(white_low, black_low), min(white_high, black_high)
+
+                # Prefer the widest range of working minimum areas
+                if low < high and (best is None or high / max(low, 1) > best[0]):
+                    best = (high / max(low, 1), i, white_threshold, black_threshold, low, high)
+
+    if best is None:
+        raise ValueError("No thresholds found that detect 88 keys")
+
+    _, index, white_threshold, black_threshold, low, high = best
+    values = {
+        "white_color": white,
+        "black_color": black,
+        "white_threshold": white_threshold,
+        "black_threshold": black_threshold,
+        # Geometric middle of the working range
+        "min_area_pixel": min(high - 1, max(low, int(np.sqrt(max(low, 1) * high)))),
+    }
+
+    if get_key_count(search_keys(frames[index], values)) != 88:
+        raise ValueError("Calibrated settings do not detect 88 keys")
+
+    return values, index
+
+
+def calibrate_video(
+    path: Path,
+    settings: dict[str, any],
+    workers: int = None,
+    root: Path = DEFAULT_CACHE_DIR,
+    check: Callable[[], None] = None,
+) -> tuple[dict[str, any], int]:
+    """Calibrate key detection on a few frames of a video and return the updated settings plus the key frame."""
+    cache = Path(root) / "calibration" / f"{hash_file(path)}.json"
+
+    # Reuse an earlier calibration of the same video
+    if cache.exists():
+        with open(cache) as file:
+            info = json.load(file)
+        values = info["settings"]
+        for key in ["white_color", "black_color"]:
+            values[key] = tuple(values[key])
+
+        logging.info(f"Calibration of '{os.path.basename(path)}' loaded from cache")
+        return {**settings, **values}, info["key_frame"]
+
+    # The check callback raises to abort calibrating (e.g. when the user cancels)
+    source = FrameSource(path, cache_bytes=0, check=check)
+    indices = sorted(set(np.linspace(0, len(source) - 1, CANDIDATE_FRAMES).astype(int).tolist()))
+    frames = []
+    try:
+        # Loop over candidate frames
+        for i in indices:
+            if check:
+                check()
+            frames.append(source[i])
+    finally:
+        source.release()
+
+    values, index = calibrate_frames(frames, workers, check)
+    key_frame = indices[index]
+    logging.info(f"Calibrated '{os.path.basename(path)}' on frame {key_frame}: {values}")
+
+    os.makedirs(cache.parent, exist_ok=True)
+    with open(cache, "w") as file:
+        json.dump({"video": os.path.basename(path), "settings": values, "key_frame": key_frame}, file)
+
+    return {**settings, **values}, key_frame
@@ -0,0 +1,362 @@
+import os
+import json
+import time
+import logging
+import argparse
+import numpy as np
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+from cv import (
+    analyse_coarse,
+    analyse_fills,
+    analyse_stream,
+    compare_probes,
+    convert_to_midi,
+    decide_keys,
+    get_key_count,
+    get_key_region,
+    get_sample_points,
+    iter_frames,
+    prepare_frame,
+    prepare_keys,
+    search_keys,
+    sweep_thresholds,
+    validate_scale,
+)
+from cache import DEFAULT_CACHE_BYTES, DEFAULT_CACHE_DIR, DecodeCache
+from calibrate import calibrate_video
+from parallel import analyse_pipeline, analyse_video
+from profiling import disable, enable
+from source import FrameSource
+from timeline import Timeline
+from tracking import TRACK_INTERVAL, LayoutTracker, analyse_tracked
+
+VIDEO_EXTENSIONS = [".mp4", ".mkv", ".avi", ".mov", ".webm"]
+FILLS_EXTENSION = ".npz"
+SCALE_SAMPLES = 10
+EXPORT_FORMATS = ["csv", "json"]
+# Analysis modes in the order convert_job picks them, with the other options each one honours
+MODE_OPTIONS = {
+    "track": ["cache-dir"],
+    "pipeline": ["workers", "probe"],
+    "probe": ["cache-dir", "skip-unchanged"],
+    "workers": ["skip-unchanged"],
+    "save-fills": ["cache-dir", "sweep"],
+    "sweep": ["cache-dir", "save-fills"],
+    "stride": ["min-note"],
+}
+SETTINGS_KEYS = [
+    "white_color", "black_color", "pressed_color",
+    "white_threshold", "black_threshold", "pressed_threshold",
+    "min_area_pixel", "min_area_percent", "midi_velocity", "note_offset",
+]
+
+
+class LogProgress:
+    """Progress callback that logs a video's progress in 10% steps."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.step = -1
+
+    def __call__(self, value: float) -> None:
+        if int(value // 10) > self.step:
+            self.step = int(value // 10)
+            logging.info(f"'{self.name}': {self.step * 10}%")
+
+
+def load_settings(path: Path) -> dict[str, any]:
+    """Load settings from a JSON file shaped like the GUI settings (colors in BGR order)."""
+    with open(path) as file:
+        settings = json.load(file)
+
+    missing = [key for key in SETTINGS_KEYS if key not in settings]
+    if missing:
+        raise ValueError(f"Settings file is missing {', '.join(missing)}")
+
+    # JSON has no tuples
+    for key in ["white_color", "black_color", "pressed_color"]:
+        settings[key] = tuple(settings[key])
+
+    return settings
+
+
+def find_videos(inputs: list[Path]) -> list[Path]:
+    """Expand directories into the videos (and saved fill ratios) they contain."""
+    videos = []
+
+    # Loop over inputs
+    for path in inputs:
+        if path.is_dir():
+            videos += sorted(p for p in path.iterdir() if p.suffix.lower() in VIDEO_EXTENSIONS + [FILLS_EXTENSION])
+        else:
+            videos.append(path)
+
+    return videos
+
+
+def parse_sweep(value: str) -> list[float]:
+    """Parse a start:stop:step range of minimum area percentages (stop included)."""
+    start, stop, step = (float(part) for part in value.split(":"))
+    return [round(v, 6) for v in np.arange(start, stop + step / 2, step)]
+
+
+def log_sweep(name: str, sweep: dict[float, int]) -> None:
+    """Log note counts of a threshold sweep."""
+    for value, notes in sweep.items():
+        logging.info(f"'{name}': min_area_percent {value:g} -> {notes} notes")
+
+
+def get_conflict(
+    workers: int = 1,
+    cache: any = None,
+    save_fills: bool = False,
+    sweep: list[float] = None,
+    skip_tolerance: int = None,
+    stride: int = None,
+    probe: bool = False,
+    pipeline: bool = False,
+    track: int = None,
+    min_note: int = None,
+) -> str:
+    """Describe options that the chosen analysis mode would ignore, or return None if all of them apply."""
+    options = {
+        "track": track is not None,
+        "pipeline": pipeline,
+        "probe": probe,
+        "workers": workers > 1,
+        "save-fills": save_fills,
+        "sweep": bool(sweep),
+        "stride": stride is not None,
+        "cache-dir": cache is not None,
+        "skip-unchanged": skip_tolerance is not None,
+        "min-note": min_note is not None,
+    }
+    active = [name for name, value in options.items() if value]
+    mode = next((name for name in MODE_OPTIONS if name in active), None)
+    if mode is None:
+        return "--min-note only applies to --stride" if min_note is not None else None
+
+    ignored = [name for name in active if name != mode and name not in MODE_OPTIONS[mode]]
+    if ignored:
+        return f"--{mode} cannot be combined with {', '.join(f'--{name}' for name in ignored)}"
+    if mode == "stride" and min_note is not None and stride > min_note:
+        return "--stride must not be longer than --min-note"
+    return None
+
+
+def convert_fills(
+    fills_path: Path,
+    midi: Path,
+    settings: dict[str, any],
+    sweep: list[float] = None,
+) -> dict[str, any]:
+    """Regenerate a MIDI file from saved fill ratios with the current minimum area percentage."""
+    start = time.perf_counter()
+    data = np.load(fills_path)
+    fills = data["fills"]
+
+    piece = decide_keys(fills, settings["min_area_percent"])
+    convert_to_midi(piece, {"fps": float(data["fps"])}, midi, settings)
+    if sweep:
+        log_sweep(fills_path.name, sweep_thresholds(fills, sweep))
+
+    seconds = time.perf_counter() - start
+    logging.info(f"'{fills_path.name}' converted in {seconds:.3f} seconds")
+    return {"video": str(fills_path), "midi": str(midi), "frames": len(fills), "seconds": seconds}
+
+
+def convert_job(
+    video: Path,
+    midi: Path,
+    settings: dict[str, any],
+    key_frame: int = 0,
+    workers: int = 1,
+    roi: bool = True,
+    cache: DecodeCache = None,
+    save_fills: bool = False,
+    sweep: list[float] = None,
+    skip_tolerance: int = None,
+    stride: int = None,
+    scale: float = 1,
+    profile: bool = False,
+    trace: Path = None,
+    calibrate: bool = False,
+    probe: bool = False,
+    pipeline: bool = False,
+    exports: list[str] = None,
+    track: int = None,
+    min_note: int = None,
+) -> dict[str, any]:
+    """Detect keys on one frame of a video and convert the whole video into a MIDI file."""
+    if video.suffix.lower() == FILLS_EXTENSION:
+        return convert_fills(video, midi, settings, sweep)
+
+    conflict = get_conflict(workers, cache, save_fills, sweep, skip_tolerance, stride, probe, pipeline, track,
+                            min_note)
+    if conflict:
+        raise ValueError(conflict)
+
+    if profile or trace:
+        enable()
+    start = time.perf_counter()
+
+    # Replace colors, thresholds and key frame by a (cached) calibration
+    if calibrate:
+        settings, key_frame = calibrate_video(video, settings, root=cache.root if cache else DEFAULT_CACHE_DIR)
+
+    # Detect keys on the chosen frame only
+    source = FrameSource(video)
+    props = source.props
+    keys = search_keys(source[key_frame], settings)
+
+    if get_key_count(keys) != 88:
+        source.release()
+        raise ValueError(f"Found {get_key_count(keys)}/88 keys on frame {key_frame} of '{video.name}'")
+
+    # Only decode and analyse the keyboard band (a tracked keyboard can move anywhere in the frame)
+    region = get_key_region(keys, props["dim"]) if roi and not track else None
+
+    # Check a few frames spread over the video at full resolution
+    samples = range(0, len(source), max(1, len(source) // SCALE_SAMPLES))
+    if scale != 1:
+        validate_scale(prepare_keys(keys, region), (prepare_frame(source[i], region) for i in samples), settings, scale)
+    if probe:
+        compare_probes(prepare_keys(keys, region, scale), (prepare_frame(source[i], region, scale) for i in samples),
+                       settings)
+    if track:
+        reference = prepare_frame(source[key_frame], region, scale)
+    source.release()
+    keys = prepare_keys(keys, region, scale)
+
+    decode = cache.iter_frames if cache else iter_frames
+    progress = LogProgress(video.name)
+
+    if track:  # Key layout re-fitted as the keyboard drifts or zooms
+        tracker = LayoutTracker(keys, reference, settings, track, scale=scale)
+        piece = analyse_tracked(tracker, decode(video, region, scale), settings, progress, props["length"])
+    elif pipeline:  # Decoder and analysis processes sharing a ring buffer
+        piece = analyse_pipeline(video, keys, settings, workers, region, scale,
+                                 get_sample_points(keys) if probe else None)
+    elif probe:  # Sample points instead of whole boxes
+        piece = analyse_stream(keys, decode(video, region, scale), settings, progress, props["length"],
+                               skip_tolerance, get_sample_points(keys))
+    elif workers > 1:  # Frame ranges on several processes
+        piece = analyse_video(video, keys, settings, workers, region, skip_tolerance, scale)
+    elif save_fills or sweep:  # Keep fill ratios for re-tuning
+        fills = analyse_fills(keys, decode(video, region, scale), settings, progress, props["length"])
+        piece = decide_keys(fills, settings["min_area_percent"])
+        if save_fills:
+            # Half precision is enough for re-tuning, this run decides on the exact ratios
+            np.savez(midi.with_suffix(FILLS_EXTENSION), fills=fills.astype(np.float16), fps=props["fps"])
+        if sweep:
+            log_sweep(video.name, sweep_thresholds(fills, sweep))
+    elif stride:  # Only frames whose keys changed, or samples if notes are known to be long enough
+        source = FrameSource(video, cache_bytes=0, keyframes=min_note is not None)
+        piece = analyse_coarse(keys, source, settings, stride, region, progress, scale, min_note)
+        source.release()
+    else:  # Single stream with constant memory
+        piece = analyse_stream(keys, decode(video, region, scale), settings, progress, props["length"],
+                               skip_tolerance)
+
+    # Note intervals instead of frames, so writing scales with the number of notes
+    timeline = Timeline.from_piece(piece, props["fps"])
+    timeline.write_midi(midi, settings)
+    if "csv" in (exports or []):
+        timeline.write_csv(midi.with_suffix(".csv"), settings)
+    if "json" in (exports or []):
+        timeline.write_json(midi.with_suffix(".json"), settings)
+
+    seconds = time.perf_counter() - start
+    logging.info(f"'{video.name}' converted in {seconds:.1f} seconds")
+
+    profiler = disable()
+    if profiler and profile:
+        logging.info(f"Profile of '{video.name}':\n{profiler.format_summary()}")
+    if profiler and trace:
+        os.makedirs(trace, exist_ok=True)
+        profiler.export_trace(trace / f"{video.stem}.trace.json")
+
+    return {"video": str(video), "midi": str(midi), "frames": props["length"], "seconds": seconds}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Convert piano videos into MIDI without the GUI")
+    parser.add_argument("inputs", type=Path, nargs="+",
+                        help="video files, saved fill ratios (.npz) or directories of them")
+    parser.add_argument("-s", "--settings", type=Path, required=True, help="JSON settings file")
+    parser.add_argument("-k", "--key-frame", type=int, default=0, help="frame index to detect keys on")
+    parser.add_argument("-o", "--output", type=Path, help="output directory (default: next to each video)")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="videos converted in parallel")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="analysis processes per video")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="decode into a shared-memory ring buffer while --workers processes analyse it")
+    parser.add_argument("--no-roi", action="store_true", help="analyse full frames instead of the keyboard band")
+    parser.add_argument("--cache-dir", type=Path, help="reuse decoded frames from this cache directory")
+    parser.add_argument("--cache-size", type=float, default=DEFAULT_CACHE_BYTES / 2 ** 30,
+                        help="decode cache size limit in GB")
+    parser.add_argument("--export", nargs="+", choices=EXPORT_FORMATS, default=[],
+                        help="also write the notes as CSV and/or JSON next to each MIDI")
+    parser.add_argument("--save-fills", action="store_true",
+                        help="save per-key fill ratios next to each MIDI for instant re-tuning")
+    parser.add_argument("--sweep", type=parse_sweep, metavar="START:STOP:STEP",
+                        help="report note counts for a range of minimum area percentages")
+    parser.add_argument("--skip-unchanged", type=int, metavar="TOLERANCE",
+                        help="reuse key states of frames whose pixels differ by at most TOLERANCE")
+    parser.add_argument("--stride", type=int,
+                        help="only analyse frames whose keys changed, and at least every STRIDE-th frame")
+    parser.add_argument("--min-note", type=int, metavar="FRAMES",
+                        help="with --stride, skip decoding intervals whose end frames match (notes and pauses must last "
+                             "at least FRAMES >= STRIDE frames)")
+    parser.add_argument("--scale", type=float, default=1,
+                        help="downscale factor applied right after decoding (e.g. 0.25 for 4K sources)")
+    parser.add_argument("--probe", action="store_true",
+                        help="test a small grid of sample points per key instead of every pixel of its box")
+    parser.add_argument("--track", type=int, nargs="?", const=TRACK_INTERVAL, metavar="INTERVAL",
+                        help="follow a moving or zooming keyboard, re-fitting the key layout every INTERVAL frames")
+    parser.add_argument("--calibrate", action="store_true",
+                        help="find key colors, thresholds and key frame automatically (cached per video)")
+    parser.add_argument("--profile", action="store_true", help="log per-stage timings and memory after each video")
+    parser.add_argument("--trace", type=Path, help="write a Chrome/Perfetto trace per video into this directory")
+    parser.add_argument("-v", "--verbose", action="store_true", help="enable debug logging")
+    args = parser.parse_args()
+
+    # Fail early instead of silently ignoring options
+    conflict = get_conflict(args.workers, args.cache_dir, args.save_fills, args.sweep, args.skip_unchanged, args.stride,
+                            args.probe, args.pipeline, args.track, args.min_note)
+    if conflict:
+        parser.error(conflict)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+    settings = load_settings(args.settings)
+    cache = DecodeCache(args.cache_dir, int(args.cache_size * 2 ** 30)) if args.cache_dir else None
+    videos = find_videos(args.inputs)
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+    midis = [(args.output or video.parent) / (video.stem + ".mid") for video in videos]
+    logging.info(f"Converting {len(videos)} videos with {args.jobs} jobs")
+
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = [executor.submit(convert_job, video, midi, settings, args.key_frame, args.workers,
+                                   not args.no_roi, cache, args.save_fills, args.sweep,
+                                   args.skip_unchanged, args.stride, args.scale,
+                                   args.profile, args.trace, args.calibrate, args.probe, args.pipeline, args.export,
+                                   args.track, args.min_note)
+                   for video, midi in zip(videos, midis)]
+
+        # Report failures without stopping the other jobs
+        for video, future in zip(videos, futures):
+            try:
+                future.result()
+            except Exception as error:
+                logging.error(f"'{video.name}' failed: {error}")
+                failed += 1
+
+    logging.info(f"{len(videos) - failed}/{len(videos)} videos converted")
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
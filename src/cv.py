@@ -1,17 +1,27 @@
 import os
 import cv2
 import mido
+import time
 import logging
-import tkinter
 import numpy as np
 from pathlib import Path
+from typing import Callable, Iterable, Iterator
 from mido import MidiFile, MidiTrack, Message
 
+from profiling import get_profiler, profiled
+
 KEYBOARD = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
 
+DEFAULT_ROI_MARGIN = 10
+MIDI_CHUNK = 4096
+DEFAULT_STRIDE = 8
+SIGNATURE_TOLERANCE = 24
+SAMPLE_GRID = (3, 4)
+SAMPLE_INSET = 0.2
+
 
-def extract_frames(path: Path, progress: tkinter.ttk.Progressbar, window: tkinter.Tk) -> tuple[list, dict[str, any]]:
-    """Load a video and return all frames plus basic properties."""
+def open_video(path: Path) -> tuple[cv2.VideoCapture, dict[str, any]]:
+    """Open a video and return the capture plus basic properties."""
     # Get video properties
     video = cv2.VideoCapture(path)
     dim = (video.get(cv2.CAP_PROP_FRAME_WIDTH),
@@ -23,34 +33,90 @@ def extract_frames(path: Path, progress: tkinter.ttk.Progressbar, window: tkinte
     logging.debug(f"> FPS: {fps}")
     logging.debug(f"> Length: {length} frames ({int(length / fps)} seconds)")
 
+    props = {"dim": dim, "fps": fps, "length": length}
+    return video, props
+
+
+def get_props(path: Path) -> dict[str, any]:
+    """Read basic properties of a video without decoding any frames."""
+    video, props = open_video(path)
+    video.release()
+    return props
+
+
+def get_frame_count(path: Path) -> int:
+    """Read the frame count a video reports in its header."""
+    video = cv2.VideoCapture(path)
+    length = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+    video.release()
+    return length
+
+
+@profiled("extract_frames")
+def extract_frames(
+    path: Path,
+    progress: Callable[[float], None] = None,
+    region: tuple[int, int, int, int] = None,
+    scale: float = 1,
+) -> tuple[list, dict[str, any]]:
+    """Load a video and return all frames (optionally cropped and downscaled) plus basic properties."""
+    video, props = open_video(path)
+    length = props["length"]
+
     ret = True
     frames = []
     frame_num = 0
-    progress["value"] = 0
-    window.update_idletasks()
+    profiler = get_profiler()
+    if progress:
+        progress(0)
 
     # While video is providing frames
     while ret:
+        start = time.perf_counter() if profiler else None
         ret, frame = video.read()
+        if profiler:
+            profiler.record("decode", start)
 
         if ret:
+            # Copy the crop, so the full frame can be freed
+            if region or scale != 1:
+                frame = prepare_frame(frame, region, scale).copy()
+
             frames.append(frame)
             frame_num += 1
 
             # Update progress every 100 frames
             if frame_num % 100 == 0:
-                progress["value"] = frame_num / length * 100
-                window.update_idletasks()
+                if progress:
+                    progress(frame_num / length * 100)
                 logging.debug(f"Frame {frame_num} extracted")
 
     video.release()
-    progress["value"] = 100
-    window.update_idletasks()
-
-    props = {"dim": dim, "fps": fps, "length": length}
+    if progress:
+        progress(100)
     return frames, props
 
 
+def iter_frames(path: Path, region: tuple[int, int, int, int] = None, scale: float = 1) -> Iterator[any]:
+    """Yield frames (optionally cropped and downscaled) one by one, so only the current frame is kept in memory."""
+    video = cv2.VideoCapture(path)
+    profiler = get_profiler()
+
+    try:
+        # While video is providing frames
+        while True:
+            start = time.perf_counter() if profiler else None
+            ret, frame = video.read()
+            if profiler:
+                profiler.record("decode", start)
+            if not ret:
+                break
+
+            yield prepare_frame(frame, region, scale)
+    finally:
+        video.release()
+
+
 def get_color_ranges(color: tuple[str, str, str], scalar: float) -> tuple[tuple[int, int, int], tuple[int, int, int]]:
     """Compute lower/upper BGR bounds based on a scalar tolerance."""
     # Round between 0 and 255
@@ -94,21 +160,19 @@ def get_key_count(keys: dict[str, tuple[int, int, int, int]]) -> int:
     return count
 
 
+def find_key_rects(frame: any, color: tuple[int, int, int], threshold: float) -> list[tuple[int, int, int, int]]:
+    """Find bounding boxes of all contours in a color mask."""
+    mask = cv2.inRange(frame, *get_color_ranges(color, threshold))
+    contours = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
+    return [cv2.boundingRect(i) for i in contours]
+
+
+@profiled("search_keys")
 def search_keys(frame: any, settings: dict[str, any]) -> dict[str, tuple[int, int, int, int]]:
     """Detect key bounding boxes from a single frame using color masks."""
-    # Define masks
-    white_mask = cv2.inRange(
-        frame, *get_color_ranges(settings["white_color"], settings["white_threshold"]))
-    black_mask = cv2.inRange(
-        frame, *get_color_ranges(settings["black_color"], settings["black_threshold"]))
-
-    # Find contours
-    white_keys = cv2.findContours(
-        white_mask.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
-    black_keys = cv2.findContours(
-        black_mask.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
-    white_keys = [cv2.boundingRect(i) for i in white_keys]
-    black_keys = [cv2.boundingRect(i) for i in black_keys]
+    # Find contours of both key colors
+    white_keys = find_key_rects(frame, settings["white_color"], settings["white_threshold"])
+    black_keys = find_key_rects(frame, settings["black_color"], settings["black_threshold"])
 
     # Filter contours
     white_keys = [(x, y, w, h) for x, y, w,
@@ -143,6 +207,99 @@ def search_keys(frame: any, settings: dict[str, any]) -> dict[str, tuple[int, in
     return keys
 
 
+def get_key_region(
+    keys: dict[str, tuple[int, int, int, int]],
+    dim: tuple[float, float],
+    margin: int = DEFAULT_ROI_MARGIN,
+) -> tuple[int, int, int, int]:
+    """Compute the union bounding box of all detected keys, widened by a margin and clipped to the frame."""
+    boxes = [(x, y, w, h) for x, y, w, h in keys.values() if w * h > 0]
+
+    # Fall back to the full frame without detected keys
+    if not boxes:
+        return 0, 0, int(dim[0]), int(dim[1])
+
+    left = max(0, min(x for x, _, _, _ in boxes) - margin)
+    top = max(0, min(y for _, y, _, _ in boxes) - margin)
+    right = min(int(dim[0]), max(x + w for x, _, w, _ in boxes) + margin)
+    bottom = min(int(dim[1]), max(y + h for _, y, _, h in boxes) + margin)
+    return left, top, right - left, bottom - top
+
+
+def crop_keys(
+    keys: dict[str, tuple[int, int, int, int]],
+    region: tuple[int, int, int, int],
+) -> dict[str, tuple[int, int, int, int]]:
+    """Shift key boxes into the coordinate system of a cropped region."""
+    rx, ry, _, _ = region
+    cropped = {}
+
+    # Loop over keys
+    for note, (x, y, w, h) in keys.items():
+        if w * h > 0:  # Detected key
+            cropped[note] = (x - rx, y - ry, w, h)
+        else:  # Placeholder
+            cropped[note] = (0, 0, 0, 0)
+
+    return cropped
+
+
+def crop_frame(frame: any, region: tuple[int, int, int, int]) -> any:
+    """Return a view of the frame limited to a region."""
+    x, y, w, h = region
+    return frame[y:y + h, x:x + w]
+
+
+def scale_keys(keys: dict[str, tuple[int, int, int, int]], scale: float) -> dict[str, tuple[int, int, int, int]]:
+    """Scale key boxes to match frames resized by a factor."""
+    scaled = {}
+
+    # Loop over keys
+    for note, (x, y, w, h) in keys.items():
+        if w * h > 0:  # Detected key
+            left, top = round(x * scale), round(y * scale)
+            scaled[note] = (left, top, max(1, round((x + w) * scale) - left), max(1, round((y + h) * scale) - top))
+        else:  # Placeholder
+            scaled[note] = (0, 0, 0, 0)
+
+    return scaled
+
+
+def scale_settings(settings: dict[str, any], scale: float) -> dict[str, any]:
+    """Scale the minimum contour area to match frames resized by a factor."""
+    return {**settings, "min_area_pixel": settings["min_area_pixel"] * scale ** 2}
+
+
+@profiled("scale_frame")
+def scale_frame(frame: any, scale: float) -> any:
+    """Resize a frame by a factor, averaging pixels when shrinking."""
+    return cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+
+def prepare_frame(frame: any, region: tuple[int, int, int, int] = None, scale: float = 1) -> any:
+    """Crop a frame to a region first and downscale the crop afterwards."""
+    if region:
+        frame = crop_frame(frame, region)
+    if scale != 1:
+        frame = scale_frame(frame, scale)
+
+    return frame
+
+
+def prepare_keys(
+    keys: dict[str, tuple[int, int, int, int]],
+    region: tuple[int, int, int, int] = None,
+    scale: float = 1,
+) -> dict[str, tuple[int, int, int, int]]:
+    """Move key boxes into the coordinate system of frames prepared by prepare_frame."""
+    if region:
+        keys = crop_keys(keys, region)
+    if scale != 1:
+        keys = scale_keys(keys, scale)
+
+    return keys
+
+
 def draw_keys(keys: dict[str, tuple[int, int, int, int]], img: any) -> any:
     """Draw key bounding boxes and a key count overlay."""
     # Loop over keys
@@ -164,93 +321,540 @@ def draw_keys(keys: dict[str, tuple[int, int, int, int]], img: any) -> any:
     return img
 
 
-def analyse_frame(keys: dict[str, tuple[int, int, int, int]], frame: any, settings: dict[str, any]) -> dict[str, bool]:
-    """Detect which keys are pressed for a single frame."""
-    pressed = get_key_dict(False)
-    mask = cv2.inRange(
-        frame, *get_color_ranges(settings["pressed_color"], settings["pressed_threshold"]))
-    detected = cv2.bitwise_and(frame, frame, mask=mask)
+def get_key_boxes(keys: dict[str, tuple[int, int, int, int]]) -> np.ndarray:
+    """Stack key boxes into a fixed-order (88, 4) array of x, y, w, h."""
+    return np.array(list(keys.values()), dtype=np.int64).reshape(-1, 4)
 
-    # Loop over keys
-    for note, (x, y, w, h) in keys.items():
-        # Check if box is not a placeholder
-        if w * h > 0:
-            box = detected[y:y + h, x:x + w]
-            color = np.count_nonzero(box)
 
-            # Check if key is pressed
-            if color / (w * h) >= settings["min_area_percent"]:
-                pressed[note] = True
+def get_key_fill(boxes: np.ndarray, frame: any, settings: dict[str, any]) -> np.ndarray:
+    """Compute the pressed fill ratio of all keys at once using an integral image."""
+    profiler = get_profiler()
+    start = time.perf_counter() if profiler else None
+    lower, higher = get_color_ranges(settings["pressed_color"], settings["pressed_threshold"])
+    mask = cv2.inRange(frame, lower, higher)
+
+    # Every pressed pixel counts once per non-zero channel (like counting the masked image)
+    if min(lower) > 0:  # All channels of a pressed pixel are non-zero
+        weights = mask
+        divisor, channels = 255, len(lower)
+    else:  # Count non-zero channels per pixel
+        detected = cv2.bitwise_and(frame, frame, mask=mask)
+        weights = np.count_nonzero(detected, axis=2).astype(np.uint8)
+        divisor, channels = 1, 1
+
+    if profiler:
+        profiler.record("mask", start)
+        start = time.perf_counter()
+
+    # Use 32-bit sums unless a full-frame sum could overflow them
+    depth = cv2.CV_32S if weights.size * 255 < 2 ** 31 else cv2.CV_64F
+    integral = cv2.integral(weights, sdepth=depth)
+
+    # Clip boxes to the frame
+    height, width = mask.shape
+    x, y, w, h = boxes.T
+    x0, x1 = np.clip(x, 0, width), np.clip(x + w, 0, width)
+    y0, y1 = np.clip(y, 0, height), np.clip(y + h, 0, height)
+
+    # Sum each box from its four corners
+    color = (integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]) / divisor * channels
+    area = w * h
+    fill = np.divide(color, area, out=np.zeros(len(boxes)), where=area > 0)
+
+    if profiler:
+        profiler.record("count", start)
+    return fill
+
+
+@profiled("analyse_frame")
+def analyse_frame(
+    keys: dict[str, tuple[int, int, int, int]],
+    frame: any,
+    settings: dict[str, any],
+    out: np.ndarray = None,
+) -> np.ndarray:
+    """Detect which keys are pressed for a single frame as a fixed-order boolean row."""
+    boxes = get_key_boxes(keys)
+    fill = get_key_fill(boxes, frame, settings)
 
-    return pressed
+    # Placeholders are never pressed
+    return np.logical_and(fill >= settings["min_area_percent"], boxes[:, 2] * boxes[:, 3] > 0, out=out)
+
+
+def validate_scale(
+    keys: dict[str, tuple[int, int, int, int]],
+    frames: Iterable[any],
+    settings: dict[str, any],
+    scale: float,
+) -> float:
+    """Compare key states of downscaled frames with full resolution and return the agreement ratio."""
+    scaled = scale_keys(keys, scale)
+    agree = 0
+    total = 0
+
+    # Loop over sample frames
+    for frame in frames:
+        full = analyse_frame(keys, frame, settings)
+        reduced = analyse_frame(scaled, scale_frame(frame, scale), settings)
+        agree += int(np.count_nonzero(full == reduced))
+        total += len(full)
+
+    ratio = agree / total if total else 1.0
+    if ratio < 1:
+        logging.warning(f"Key states at scale {scale} disagree with full resolution ({ratio:.2%} agreement)")
+    else:
+        logging.debug(f"Key states at scale {scale} agree with full resolution")
+
+    return ratio
+
+
+def get_sample_points(
+    keys: dict[str, tuple[int, int, int, int]],
+    grid: tuple[int, int] = SAMPLE_GRID,
+    inset: float = SAMPLE_INSET,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Place a columns x rows grid of sample points inside each key box, away from its edges and the black keys."""
+    boxes = get_key_boxes(keys).astype(float)
+    x, y, w, h = boxes.T
+    valid = w * h > 0
+    black = np.array(["#" in note for note in keys]) & valid
+    top = y.copy()
+
+    # White keys are only sampled below the black keys, where no neighbour overlaps them
+    if black.any():
+        bottom = (y + h)[black].max()
+        below = ~black & (bottom < y + h)
+        top[below] = np.maximum(y[below], bottom)
+
+    # Evenly spaced fractions between the insets
+    columns = inset + (1 - 2 * inset) * (np.arange(grid[0]) + 0.5) / grid[0]
+    rows = inset + (1 - 2 * inset) * (np.arange(grid[1]) + 0.5) / grid[1]
+    xs = x[:, None, None] + w[:, None, None] * columns[None, None, :]
+    ys = top[:, None, None] + (y + h - top)[:, None, None] * rows[None, :, None]
+    xs, ys = np.broadcast_arrays(xs, ys)
+
+    return ys.reshape(len(boxes), -1).astype(np.intp), xs.reshape(len(boxes), -1).astype(np.intp), valid
+
+
+@profiled("probe_frame")
+def probe_frame(
+    points: tuple[np.ndarray, np.ndarray, np.ndarray],
+    frame: any,
+    settings: dict[str, any],
+    out: np.ndarray = None,
+) -> np.ndarray:
+    """Detect pressed keys from their sample points only, weighted like the full-box fill ratio."""
+    ys, xs, valid = points
+    height, width = frame.shape[:2]
+
+    # Gather all sample pixels at once as (keys, points, channels)
+    pixels = frame[np.clip(ys, 0, height - 1), np.clip(xs, 0, width - 1)]
+    lower, higher = get_color_ranges(settings["pressed_color"], settings["pressed_threshold"])
+    inside = np.all((pixels >= lower) & (pixels <= higher), axis=2)
+
+    # Every pressed sample counts once per non-zero channel
+    if min(lower) > 0:
+        weights = inside * len(lower)
+    else:
+        weights = inside * np.count_nonzero(pixels, axis=2)
 
+    return np.logical_and(weights.mean(axis=1) >= settings["min_area_percent"], valid, out=out)
 
+
+def compare_probes(
+    keys: dict[str, tuple[int, int, int, int]],
+    frames: Iterable[any],
+    settings: dict[str, any],
+) -> float:
+    """Compare key states of sample-point probing with the full-box method and return the agreement ratio."""
+    points = get_sample_points(keys)
+    notes = list(keys.keys())
+    disagree = np.zeros(len(notes), dtype=np.int64)
+    total = 0
+
+    # Loop over sample frames
+    for frame in frames:
+        disagree += analyse_frame(keys, frame, settings) != probe_frame(points, frame, settings)
+        total += 1
+
+    ratio = 1 - disagree.sum() / (total * len(notes)) if total else 1.0
+    if ratio < 1:
+        worst = ", ".join(f"{notes[i]} ({disagree[i]}/{total})" for i in np.argsort(-disagree)[:5] if disagree[i])
+        logging.warning(f"Sample points disagree with full boxes ({ratio:.2%} agreement, keys: {worst})")
+    else:
+        logging.info(f"Sample points agree with full boxes on {total} frames")
+
+    return ratio
+
+
+def is_unchanged(frame: any, reference: any, tolerance: int) -> bool:
+    """Check whether no pixel of a frame differs from a reference frame by more than a tolerance."""
+    if reference is None or frame.shape != reference.shape:
+        return False
+
+    return cv2.norm(frame, reference, cv2.NORM_INF) <= tolerance
+
+
+def skip_unchanged(frames: Iterable[any], tolerance: int = None) -> Iterator[tuple[any, bool]]:
+    """Yield (frame, changed) pairs, where unchanged frames look the same as the last changed one."""
+    reference = None
+    skipped = 0
+    frame_num = 0
+
+    # Loop over frames
+    for frame in frames:
+        frame_num += 1
+        if tolerance is None:
+            yield frame, True
+        elif is_unchanged(frame, reference, tolerance):
+            skipped += 1
+            yield frame, False
+        else:
+            reference = frame.copy()
+            yield frame, True
+
+    if tolerance is not None:
+        logging.info(f"{skipped}/{frame_num} unchanged frames skipped")
+
+
+@profiled("analyse_frames")
 def analyse_frames(
     keys: dict[str, tuple[int, int, int, int]],
-    frames: list[any],
-    progress: tkinter.ttk.Progressbar,
-    window: tkinter.Tk, settings: dict[str, any],
-) -> list[dict[str, bool]]:
-    """Analyse all frames and return a list of per-frame key states."""
-    piece = []
+    frames: Iterable[any],
+    settings: dict[str, any],
+    progress: Callable[[float], None] = None,
+    length: int = None,
+    skip_tolerance: int = None,
+) -> np.ndarray:
+    """Analyse all frames (list or stream of known length) into a frames x 88 boolean key-state matrix."""
+    length = length or len(frames)
+    piece = np.zeros((max(1, int(length)), len(keys)), dtype=bool)
+    frame_num = 0
+
+    # Loop over frames
+    for i, (frame, changed) in enumerate(skip_unchanged(frames, skip_tolerance)):
+        # Frame counts can be too low, so grow the buffer if needed
+        if i == len(piece):
+            piece = np.concatenate([piece, np.zeros_like(piece)])
+
+        # Reuse the previous states while the frame looks the same as the last analysed one
+        if changed:
+            analyse_frame(keys, frame, settings, out=piece[i])
+        else:
+            piece[i] = piece[i - 1]
+        frame_num += 1
+
+        # Update progress every 100 frames
+        if i % 100 == 0:
+            if progress:
+                progress(i / length * 100)
+            logging.debug(f"Frame {i} analysed")
+
+    if progress:
+        progress(100)
+    return piece[:frame_num]
+
+
+@profiled("analyse_fills")
+def analyse_fills(
+    keys: dict[str, tuple[int, int, int, int]],
+    frames: Iterable[any],
+    settings: dict[str, any],
+    progress: Callable[[float], None] = None,
+    length: int = None,
+    dtype: np.dtype = np.float64,
+) -> np.ndarray:
+    """Analyse all frames into a frames x 88 matrix of pressed fill ratios (NaN for placeholders)."""
+    boxes = get_key_boxes(keys)
+    placeholders = boxes[:, 2] * boxes[:, 3] == 0
+    length = length or len(frames)
+    fills = np.zeros((max(1, int(length)), len(keys)), dtype=dtype)
+    frame_num = 0
 
     # Loop over frames
     for i, frame in enumerate(frames):
-        pressed = analyse_frame(keys, frame, settings)
-        piece.append(pressed)
+        # Frame counts can be too low, so grow the buffer if needed
+        if i == len(fills):
+            fills = np.concatenate([fills, np.zeros_like(fills)])
+
+        fills[i] = get_key_fill(boxes, frame, settings)
+        fills[i, placeholders] = np.nan
+        frame_num += 1
 
         # Update progress every 100 frames
         if i % 100 == 0:
-            progress["value"] = i / len(frames) * 100
-            window.update_idletasks()
+            if progress:
+                progress(i / length * 100)
             logging.debug(f"Frame {i} analysed")
 
-    progress["value"] = 100
-    window.update_idletasks()
+    if progress:
+        progress(100)
+    return fills[:frame_num]
+
+
+def decide_keys(fills: np.ndarray, min_area_percent: float) -> np.ndarray:
+    """Turn a fill-ratio matrix into a key-state matrix for a minimum area percentage."""
+    # Compare in full precision, placeholders (NaN) are never pressed
+    return fills >= np.float64(min_area_percent)
+
+
+def count_notes(piece: np.ndarray) -> int:
+    """Count pressed notes (rising edges) in a key-state matrix."""
+    if len(piece) == 0:
+        return 0
+
+    return int(np.count_nonzero(piece[0]) + np.count_nonzero(piece[1:] & ~piece[:-1]))
+
+
+def sweep_thresholds(fills: np.ndarray, values: Iterable[float]) -> dict[float, int]:
+    """Count the notes a fill-ratio matrix yields for a range of minimum area percentages."""
+    return {value: count_notes(decide_keys(fills, value)) for value in values}
+
+
+def analyse_stream(
+    keys: dict[str, tuple[int, int, int, int]],
+    frames: Iterable[any],
+    settings: dict[str, any],
+    progress: Callable[[float], None] = None,
+    length: int = None,
+    skip_tolerance: int = None,
+    points: tuple[np.ndarray, np.ndarray, np.ndarray] = None,
+) -> Iterator[np.ndarray]:
+    """Analyse frames lazily (whole boxes or only sample points) and yield per-frame key-state rows as they are ready."""
+    pressed = None
+
+    # Loop over frames, reusing the previous states while a frame looks the same as the last analysed one
+    for i, (frame, changed) in enumerate(skip_unchanged(frames, skip_tolerance)):
+        if changed and points is not None:  # Sample points only
+            pressed = probe_frame(points, frame, settings)
+        elif changed:
+            pressed = analyse_frame(keys, frame, settings)
+        yield pressed
+
+        # Update progress every 100 frames
+        if i % 100 == 0:
+            if progress and length:
+                progress(i / length * 100)
+            logging.debug(f"Frame {i} analysed")
+
+    if progress:
+        progress(100)
+
+
+def get_signature(points: tuple[np.ndarray, np.ndarray, np.ndarray], frame: any) -> np.ndarray:
+    """Gather the pixels at the key sample points as a cheap fingerprint of the keyboard."""
+    ys, xs, _ = points
+    height, width = frame.shape[:2]
+    return frame[np.clip(ys, 0, height - 1), np.clip(xs, 0, width - 1)].astype(np.int16)
+
+
+@profiled("analyse_coarse")
+def analyse_coarse(
+    keys: dict[str, tuple[int, int, int, int]],
+    frames: any,
+    settings: dict[str, any],
+    stride: int = DEFAULT_STRIDE,
+    region: tuple[int, int, int, int] = None,
+    progress: Callable[[float], None] = None,
+    scale: float = 1,
+    min_note: int = None,
+) -> np.ndarray:
+    """Analyse a frame source coarsely: only frames whose keys changed, or (given a minimum note length) samples."""
+    if min_note is not None and stride > min_note:
+        raise ValueError(f"Stride of {stride} frames is longer than the shortest note ({min_note} frames)")
+
+    # Skipping intervals only saves time if seeking skips decoding their frames
+    if min_note is not None and frames.skips_frames(stride):
+        return analyse_sampled(keys, frames, settings, stride, region, progress, scale)
+    if min_note is not None:
+        logging.info(f"Seeking every {stride} frames decodes every frame anyway, checking all of them")
+
+    length = len(frames)
+    points = get_sample_points(keys)
+    piece = np.zeros((max(1, length), len(keys)), dtype=bool)
+    reference = None
+    analysed = 0
+    last = 0
+    frame_num = 0
+
+    # Loop over all frames, as only decoded frames can show that nothing changed
+    for i, frame in enumerate(frames):
+        if i == len(piece):
+            piece = np.concatenate([piece, np.zeros_like(piece)])
+
+        frame = prepare_frame(frame, region, scale)
+        signature = get_signature(points, frame)
+
+        # Analyse when any sample point moved away from the last analysed frame, and at least every stride frames
+        if reference is None or i - last >= stride or np.abs(signature - reference).max() > SIGNATURE_TOLERANCE:
+            analyse_frame(keys, frame, settings, out=piece[i])
+            reference = signature
+            last = i
+            analysed += 1
+        else:
+            piece[i] = piece[i - 1]
+        frame_num += 1
+
+        # Update progress every 100 frames
+        if i % 100 == 0:
+            if progress and length:
+                progress(i / length * 100)
+            logging.debug(f"Frame {i} checked")
+
+    if progress:
+        progress(100)
+    logging.info(f"{analysed}/{frame_num} frames analysed, the others matched the last analysed frame")
+    return piece[:frame_num]
+
+
+def analyse_sampled(
+    keys: dict[str, tuple[int, int, int, int]],
+    frames: any,
+    settings: dict[str, any],
+    stride: int,
+    region: tuple[int, int, int, int] = None,
+    progress: Callable[[float], None] = None,
+    scale: float = 1,
+) -> np.ndarray:
+    """Analyse every stride-th frame and all frames of intervals whose ends differ, assuming the others unchanged."""
+    length = len(frames)
+    states = {}
+    assumed = 0
+
+    def analyse(i: int) -> np.ndarray:
+        if i not in states:
+            states[i] = analyse_frame(keys, prepare_frame(frames[i], region, scale), settings)
+        return states[i]
+
+    # Sample every stride-th frame plus the last one
+    samples = list(range(0, length, stride))
+    if samples and samples[-1] != length - 1:
+        samples.append(length - 1)
+
+    # Loop over sampled intervals
+    for i, (start, stop) in enumerate(zip(samples, samples[1:])):
+        if (analyse(start) != analyse(stop)).any():
+            # Frame-exact transitions, decoded forward from the start of the interval
+            for j in range(start + 1, stop):
+                analyse(j)
+        elif stop - start > 1:
+            assumed += 1
+            logging.debug(f"Frames {start + 1}-{stop - 1} assumed unchanged")
+
+        # Update progress every 100 intervals
+        if i % 100 == 0:
+            if progress:
+                progress(start / length * 100)
+            logging.debug(f"Frame {start} analysed")
+
+    # Key states stay the same until the next analysed frame
+    piece = np.zeros((length, len(keys)), dtype=bool)
+    analysed = sorted(states)
+    for start, stop in zip(analysed, analysed[1:] + [length]):
+        piece[start:stop] = states[start]
+
+    if progress:
+        progress(100)
+    logging.info(f"{len(states)}/{length} frames analysed")
+    if assumed:
+        logging.warning(f"{assumed} intervals ({length - len(states)} frames) were not decoded and assumed unchanged, "
+                        f"as their end frames match")
     return piece
 
 
-def convert_to_midi(piece: list[dict[str, bool]], props: dict[str, any], path: Path, settings: dict[str, any]) -> None:
-    """Convert a frame-by-frame key map into a MIDI file."""
+def pack_piece(piece: np.ndarray) -> np.ndarray:
+    """Bit-pack a frames x 88 key-state matrix into 11 bytes per frame."""
+    return np.packbits(piece, axis=1)
+
+
+def unpack_piece(packed: np.ndarray, keys: int = 88) -> np.ndarray:
+    """Restore a frames x 88 key-state matrix from its bit-packed form."""
+    return np.unpackbits(packed, axis=1, count=keys).astype(bool)
+
+
+def iter_chunks(piece: Iterable[np.ndarray], size: int = MIDI_CHUNK) -> Iterator[np.ndarray]:
+    """Group key-state rows (matrix or stream) into matrices of at most size frames."""
+    # Slice matrices directly
+    if isinstance(piece, np.ndarray):
+        for start in range(0, len(piece), size):
+            yield piece[start:start + size]
+        return
+
+    rows = []
+    for pressed in piece:
+        rows.append(pressed)
+        if len(rows) == size:
+            yield np.array(rows)
+            rows = []
+
+    if rows:
+        yield np.array(rows)
+
+
+def get_note_events(piece: np.ndarray, previous: np.ndarray = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Find all key-state transitions of a matrix as (frame, key, state) arrays in frame, then key order."""
+    if previous is None:
+        previous = np.zeros(piece.shape[1], dtype=bool)
+
+    # Compare every frame with the one before
+    changed = np.empty_like(piece)
+    changed[0] = piece[0] != previous
+    np.not_equal(piece[1:], piece[:-1], out=changed[1:])
+
+    frames, keys = np.nonzero(changed)
+    return frames, keys, piece[frames, keys]
+
+
+def append_note_events(
+    track: MidiTrack,
+    frames: np.ndarray,
+    keys: np.ndarray,
+    states: np.ndarray,
+    ticks: int,
+    last: int,
+    settings: dict[str, any],
+) -> int:
+    """Append sorted note events to a track and return the frame of the last event."""
+    if len(frames) == 0:
+        return last
+
+    # Delta times count frames since the previous event (0 within the same frame)
+    delays = np.diff(frames, prepend=last) * ticks
+    notes = keys + settings["note_offset"]
+
+    track.extend(
+        Message("note_on" if state else "note_off", note=note, velocity=settings["midi_velocity"], time=delay)
+        for note, state, delay in zip(notes.tolist(), states.tolist(), delays.tolist()))
+    return int(frames[-1])
+
+
+@profiled("convert_to_midi")
+def convert_to_midi(piece: Iterable[np.ndarray], props: dict[str, any], path: Path, settings: dict[str, any]) -> None:
+    """Convert frame-by-frame key states (matrix or stream of rows) into a MIDI file."""
     # Initial setup
     track = MidiTrack()
     midi = MidiFile(type=0)
     midi.tracks.append(track)
     track.append(Message("program_change", program=0, time=0))
 
-    previous = get_key_dict(False)
+    ticks = mido.second2tick(1 / props["fps"], midi.ticks_per_beat, 500000)
+    previous = None
     messages = 0
-    delay = 0
-
-    # Loop over piece
-    for time, pressed in enumerate(piece):
-        delay += 1
+    offset = 0
+    # The first event is delayed by one frame more than the following ones
+    last = -1
 
-        # Loop over notes
-        for key, (note, state) in enumerate(pressed.items()):
-            # Check if note changed
-            if state != previous[note]:
-                ticks = int(mido.second2tick(
-                    1 / props["fps"], midi.ticks_per_beat, 500000) * delay)
+    # Loop over chunks of the piece
+    for chunk in iter_chunks(piece):
+        frames, keys, states = get_note_events(chunk, previous)
+        last = append_note_events(track, frames + offset, keys, states, ticks, last, settings)
 
-                if state:  # Note pressed
-                    track.append(
-                        Message("note_on", note=settings["note_offset"] + key, velocity=settings["midi_velocity"],
-                                time=ticks))
-                else:  # Note released
-                    track.append(
-                        Message("note_off", note=settings["note_offset"] + key, velocity=settings["midi_velocity"],
-                                time=ticks))
-
-                delay = 0
-                messages += 1
-
-        previous = pressed.copy()
-
-        # Update progress every 100 times
-        if time % 100 == 0:
-            logging.debug(f"Timing {time} converted")
+        previous = chunk[-1].copy()
+        messages += len(frames)
+        offset += len(chunk)
+        logging.debug(f"Timing {offset} converted")
 
     midi.save(path)
     logging.info(
         f"MIDI '{os.path.basename(path)}' saved ({messages} messages)")
+
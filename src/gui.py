@@ -1,22 +1,36 @@
 import os
 import ast
+import queue
 import logging
 import tkinter
+import threading
 from pathlib import Path
+from collections import OrderedDict
 from PIL import Image, ImageTk
 from tkinter import Tk, Toplevel, Frame, Label, Entry, Button, StringVar, filedialog, messagebox
 from tkinter.ttk import Progressbar
+from typing import Callable, Iterable, Iterator
 
 from cv import (
     analyse_frames,
     convert_to_midi,
+    crop_keys,
     draw_keys,
-    extract_frames,
     get_key_count,
+    get_key_region,
+    iter_frames,
+    scale_frame,
+    scale_keys,
     search_keys,
 )
+from calibrate import calibrate_video
+from source import FrameSource
 
 PREVIEW_DIMENSIONS = (960, 540)
+POLL_INTERVAL = 50
+PREVIEW_DEBOUNCE = 80
+PREVIEW_CACHE_SIZE = 32
+LAYOUT_SETTINGS = ["white_color", "black_color", "white_threshold", "black_threshold", "min_area_pixel"]
 
 DEFAULT_WHITE_COLOR = (255, 255, 255)
 DEFAULT_BLACK_COLOR = (0, 0, 0)
@@ -32,6 +46,91 @@ DEFAULT_MIDI_VELOCITY = 64
 DEFAULT_NOTE_OFFSET = 21
 
 
+class Cancelled(Exception):
+    """Raised on a worker thread when its job was cancelled."""
+
+
+class Job:
+    """Run a pipeline stage on a worker thread, reporting back through a queue polled by the Tk main loop."""
+
+    def __init__(
+        self,
+        root: Tk,
+        progressbar: Progressbar,
+        target: Callable[["Job"], any],
+        on_done: Callable[[any], None],
+    ) -> None:
+        self.root = root
+        self.progressbar = progressbar
+        self.on_done = on_done
+        self.messages = queue.Queue()
+        self.cancelled = threading.Event()
+        self.running = True
+
+        self.progressbar["value"] = 0
+        self.thread = threading.Thread(target=self.run, args=(target,), daemon=True)
+        self.thread.start()
+        self.root.after(POLL_INTERVAL, self.poll)
+
+    def run(self, target: Callable[["Job"], any]) -> None:
+        """Execute the job and queue its outcome (worker thread)."""
+        try:
+            self.messages.put(("done", target(self)))
+        except Cancelled:
+            self.messages.put(("cancelled", None))
+        except Exception as error:
+            logging.exception("Job failed")
+            self.messages.put(("error", error))
+
+    def check(self) -> None:
+        """Stop the job if it was cancelled (worker thread)."""
+        if self.cancelled.is_set():
+            raise Cancelled()
+
+    def report(self, value: float) -> None:
+        """Progress callback that queues the value for the progress bar (worker thread)."""
+        self.check()
+        self.messages.put(("progress", value))
+
+    def iterate(self, items: Iterable[any]) -> Iterator[any]:
+        """Yield items until the job is cancelled (worker thread)."""
+        for item in items:
+            self.check()
+            yield item
+
+    def cancel(self) -> None:
+        """Ask the worker thread to stop at the next frame."""
+        self.cancelled.set()
+
+    def poll(self) -> None:
+        """Apply queued messages to the GUI (main thread)."""
+        while self.running:
+            try:
+                kind, value = self.messages.get_nowait()
+            except queue.Empty:
+                break
+
+            if kind == "progress":
+                self.progressbar["value"] = value
+                continue
+
+            self.running = False
+            # A job that finished right after Cancel was pressed is still treated as cancelled
+            if kind == "done" and self.cancelled.is_set():
+                kind = "cancelled"
+            if kind == "done":
+                self.progressbar["value"] = 100
+                self.on_done(value)
+            elif kind == "cancelled":
+                self.progressbar["value"] = 0
+                logging.info("Job cancelled")
+            else:
+                messagebox.showerror("Error", str(value))
+
+        if self.running:
+            self.root.after(POLL_INTERVAL, self.poll)
+
+
 class MainWindow:
     """Main application window for the conversion workflow."""
 
@@ -41,6 +140,10 @@ class MainWindow:
         self.keys = None
         self.piece = None
         self.preview_idx = 0
+        self.preview_cache = OrderedDict()
+        self.preview_after = None
+        self.extract_job = None
+        self.analyse_job = None
 
         self.root = Tk()
         self.root.title("Piano Syntheses - Main")
@@ -71,6 +174,9 @@ class MainWindow:
         button_extract = Button(master=frame_extract, text="Extract", width=5, height=1,
                                 command=self.extract)
         button_extract.grid(row=0, column=1)
+        button_cancel_extract = Button(master=frame_extract, text="Cancel", width=5, height=1,
+                                       command=lambda: self.cancel(self.extract_job))
+        button_cancel_extract.grid(row=0, column=2)
         frame_extract.pack()
 
         # Preview: step through extracted frames and validate key detection
@@ -94,6 +200,9 @@ class MainWindow:
         button_analyze = Button(master=frame_analyse, text="Analyze", width=5, height=1,
                                 command=self.analyze)
         button_analyze.grid(row=0, column=1)
+        button_cancel_analyse = Button(master=frame_analyse, text="Cancel", width=5, height=1,
+                                       command=lambda: self.cancel(self.analyse_job))
+        button_cancel_analyse.grid(row=0, column=2)
         frame_analyse.pack()
 
         # Output: select destination MIDI file
@@ -110,13 +219,20 @@ class MainWindow:
         logging.debug("Main window created")
 
     def update_preview(self, img: any) -> None:
-        """Resize and display a frame preview in the GUI."""
-        img = Image.fromarray(img).resize(PREVIEW_DIMENSIONS)
+        """Display an already downscaled frame preview in the GUI."""
+        img = Image.fromarray(img)
         self.preview_image = img
         img = ImageTk.PhotoImage(img)
         self.label_preview.configure(image=img)
         self.label_preview.image = img
 
+    def cancel(self, job: Job) -> None:
+        """Cancel a running job."""
+        if job and job.running:
+            job.cancel()
+        else:
+            logging.warning("Nothing to cancel")
+
     def browse_open_file(self, var: tkinter.Variable) -> None:
         file = filedialog.askopenfilename(
             initialdir=os.getcwd(), title="Open a video")
@@ -128,18 +244,59 @@ class MainWindow:
         var.set(file)
 
     def extract(self) -> None:
-        """Extract frames and initialize the settings window."""
+        """Open the video for lazy preview decoding on a worker thread."""
         if self.video_file.get():
+            if self.extract_job and self.extract_job.running:
+                logging.warning("Frame extraction is already running")
+                return
+
             logging.debug("Frame extraction started")
-            self.frames, self.props = extract_frames(
-                Path(self.video_file.get()), self.progressbar_extract, self.root)
-            self.settings_window = SettingsWindow(self)
-            self.switch_preview(0)
-            logging.info("Frame extraction completed")
+            path = Path(self.video_file.get())
+            self.extract_job = Job(self.root, self.progressbar_extract, lambda job: FrameSource(path, check=job.check),
+                                   self.extracted)
         else:
             logging.warning("No video file selected")
             messagebox.showwarning("Warning", "Please select a video!")
 
+    def extracted(self, frames: FrameSource) -> None:
+        """Show the opened video and initialize the settings window."""
+        if self.frames is not None:
+            self.frames.release()
+        self.frames = frames
+        self.props = self.frames.props
+        self.preview_idx = 0
+        self.preview_cache.clear()
+        if self.settings_window is not None:
+            self.settings_window.root.destroy()
+        self.settings_window = SettingsWindow(self)
+        self.switch_preview(0)
+        logging.info("Frame extraction completed")
+
+    def calibrate(self) -> None:
+        """Search key colors and thresholds on a worker thread and apply them to the settings window."""
+        if self.frames:
+            if self.extract_job and self.extract_job.running:
+                logging.warning("Frame extraction or calibration is already running")
+                return
+
+            logging.debug("Calibration started")
+            path = self.frames.path
+            self.extract_job = Job(self.root, self.progressbar_extract,
+                                   lambda job: calibrate_video(path, {}, check=job.check), self.calibrated)
+        else:
+            logging.warning("No frames extracted")
+            messagebox.showwarning("Warning", "Please extract frames!")
+
+    def calibrated(self, result: tuple[dict[str, any], int]) -> None:
+        """Fill in the calibrated settings and show the frame they were found on."""
+        values, key_frame = result
+        if self.settings_window is not None:
+            self.settings_window.set_settings(values)
+            self.settings = self.settings_window.get_settings()
+            self.preview_idx = key_frame
+            self.switch_preview(0)
+        logging.info("Calibration completed")
+
     def switch_preview(self, direction: int) -> None:
         """Move the preview cursor and re-run key detection for that frame."""
         if self.frames:
@@ -147,10 +304,11 @@ class MainWindow:
                 # Prevent out-of-bounds navigation
                 if 0 <= self.preview_idx + direction < len(self.frames):
                     self.preview_idx += direction
-                    self.keys = search_keys(
-                        self.frames[self.preview_idx], self.settings)
-                    self.update_preview(
-                        draw_keys(self.keys, self.frames[self.preview_idx].copy()))
+
+                    # Collapse rapid clicks, so only the latest frame is rendered
+                    if self.preview_after is not None:
+                        self.root.after_cancel(self.preview_after)
+                    self.preview_after = self.root.after(PREVIEW_DEBOUNCE, self.render_preview)
             else:
                 logging.warning("Settings are invalid")
                 messagebox.showwarning(
@@ -159,22 +317,58 @@ class MainWindow:
             logging.warning("No frames extracted")
             messagebox.showwarning("Warning", "Please extract frames!")
 
+    def render_preview(self) -> None:
+        """Detect keys on the current preview frame and display them, reusing earlier results."""
+        if self.preview_after is not None:
+            self.root.after_cancel(self.preview_after)
+            self.preview_after = None
+
+        cache_key = (self.preview_idx, tuple(self.settings[key] for key in LAYOUT_SETTINGS))
+        if cache_key in self.preview_cache:
+            self.preview_cache.move_to_end(cache_key)
+        else:
+            frame = self.frames[self.preview_idx]
+            keys = search_keys(frame, self.settings)
+
+            # Draw on the downscaled frame instead of resizing the full frame afterwards
+            scale = PREVIEW_DIMENSIONS[0] / frame.shape[1]
+            img = draw_keys(scale_keys(keys, scale), scale_frame(frame, scale))
+
+            self.preview_cache[cache_key] = (keys, img)
+            if len(self.preview_cache) > PREVIEW_CACHE_SIZE:
+                self.preview_cache.popitem(last=False)
+
+        self.keys, img = self.preview_cache[cache_key]
+        self.update_preview(img)
+
     def analyze(self) -> None:
         """Run full analysis and export a MIDI file."""
+        # Apply a preview that is still waiting for the debounce
+        if self.preview_after is not None and self.settings:
+            self.render_preview()
+
         if self.midi_file.get():
             if self.frames:
                 if self.settings:
-                    if get_key_count(self.keys) == 88:
+                    if self.analyse_job and self.analyse_job.running:
+                        logging.warning("Analysing is already running")
+                    elif get_key_count(self.keys) == 88:
                         logging.debug("Analysing started")
-                        self.piece = analyse_frames(self.keys, self.frames, self.progressbar_analyse, self.root,
-                                                    self.settings)
-                        logging.info("Analysing completed")
-                        logging.debug("Conversion started")
-                        convert_to_midi(self.piece, self.props,
-                                        Path(self.midi_file.get()), self.settings)
-                        logging.info("Conversion completed")
-
-                        self.settings_window.root.destroy()
+                        # Stream the keyboard band on its own capture, so previews stay usable meanwhile
+                        region = get_key_region(self.keys, self.props["dim"])
+                        keys = crop_keys(self.keys, region)
+                        path, length, props = self.frames.path, len(self.frames), self.props
+                        settings, midi = dict(self.settings), Path(self.midi_file.get())
+
+                        def run(job: Job) -> any:
+                            frames = job.iterate(iter_frames(path, region))
+                            piece = analyse_frames(keys, frames, settings, job.report, length)
+                            logging.info("Analysing completed")
+                            convert_to_midi(piece, props, midi, settings)
+                            logging.info("Conversion completed")
+                            return piece
+
+                        self.analyse_job = Job(self.root, self.progressbar_analyse, run, self.analysed)
                     else:
                         logging.warning("Key count is invalid")
                         messagebox.showwarning(
@@ -190,9 +384,16 @@ class MainWindow:
             logging.warning("No midi file selected")
             messagebox.showwarning("Warning", "Please select a MIDI!")
 
+    def analysed(self, piece: any) -> None:
+        """Keep the analysed piece and close the settings window."""
+        self.piece = piece
+        if self.settings_window is not None:
+            self.settings_window.root.destroy()
+            self.settings_window = None
+
     def image_click_event(self, event) -> None:
         """Pick an RGB color from the preview for setting calibration."""
-        if self.frames:
+        if self.frames and self.settings_window:
             rgb = self.preview_image.getpixel((event.x, event.y))
             self.settings_window.selected_color.set(str(rgb))
 
@@ -318,6 +519,9 @@ class SettingsWindow:
         button_refresh = Button(
             master=self.root, text="Refresh", width=5, height=1, command=self.refresh)
         button_refresh.pack()
+        button_calibrate = Button(
+            master=self.root, text="Calibrate", width=7, height=1, command=self.main_window.calibrate)
+        button_calibrate.pack()
 
         logging.debug("Settings window created")
         self.main_window.settings = self.get_settings()
@@ -327,6 +531,13 @@ class SettingsWindow:
         self.main_window.settings = self.get_settings()
         self.main_window.switch_preview(0)
 
+    def set_settings(self, values: dict[str, any]) -> None:
+        """Fill the UI fields from (partial) settings with BGR colors."""
+        for key, value in values.items():
+            if key.endswith("_color"):  # Convert BGR to RGB
+                value = tuple(value[::-1])
+            getattr(self, key).set(str(value))
+
     def get_settings(self) -> dict[str, any]:
         """Parse and validate settings from the UI fields."""
         settings = {}
@@ -0,0 +1,253 @@
+import os
+import cv2
+import mido
+import time
+import logging
+import argparse
+import threading
+import numpy as np
+from pathlib import Path
+from mido import Message, MidiFile, MidiTrack
+
+from cv import (
+    analyse_frame,
+    append_note_events,
+    get_key_count,
+    get_key_region,
+    prepare_frame,
+    prepare_keys,
+    search_keys,
+)
+from cli import load_settings
+
+DEFAULT_FPS = 30
+DETECT_ATTEMPTS = 100
+SAVE_INTERVAL = 10
+REPORT_INTERVAL = 5
+
+
+class LatestFrame:
+    """Capture thread that keeps only the newest frame, so a slow consumer drops frames instead of building a backlog."""
+
+    def __init__(self, source: str | int, realtime: bool = False, drop: bool = True) -> None:
+        self.video = cv2.VideoCapture(source)
+        if not self.video.isOpened():
+            raise ValueError(f"Could not open source '{source}'")
+
+        self.fps = self.video.get(cv2.CAP_PROP_FPS) or DEFAULT_FPS
+        self.dim = (self.video.get(cv2.CAP_PROP_FRAME_WIDTH), self.video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.realtime = realtime
+        self.drop = drop
+        self.slot = None
+        self.dropped = 0
+        self.finished = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self) -> None:
+        """Read frames into the slot until the source ends or the capture is stopped (capture thread)."""
+        start = time.perf_counter()
+        index = 0
+
+        try:
+            while not self.finished:
+                # Play files back at their frame rate, like a live stream
+                if self.realtime:
+                    delay = start + index / self.fps - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+
+                ret, frame = self.video.read()
+                if not ret:
+                    break
+                captured = time.perf_counter()
+
+                with self.condition:
+                    # Without dropping, wait until the previous frame was taken
+                    while self.slot is not None and not self.drop and not self.finished:
+                        self.condition.wait()
+                    if self.slot is not None:
+                        self.dropped += 1
+
+                    self.slot = (index, captured, frame)
+                    self.condition.notify_all()
+                index += 1
+        finally:
+            with self.condition:
+                self.finished = True
+                self.condition.notify_all()
+            self.video.release()
+
+    def get(self) -> tuple[int, float, any]:
+        """Wait for the newest frame as (index, capture time, frame), or None once the source has ended."""
+        with self.condition:
+            while self.slot is None and not self.finished:
+                self.condition.wait()
+
+            item, self.slot = self.slot, None
+            self.condition.notify_all()
+            return item
+
+    def stop(self) -> None:
+        """Stop capturing and wait for the capture thread."""
+        with self.condition:
+            self.finished = True
+            self.condition.notify_all()
+        self.thread.join()
+
+
+class PortOutput:
+    """Send note events to a MIDI output port as soon as they are detected."""
+
+    def __init__(self, name: str, settings: dict[str, any]) -> None:
+        self.port = mido.open_output(name)
+        self.settings = settings
+
+    def emit(self, index: int, keys: np.ndarray, states: np.ndarray) -> None:
+        for key, state in zip(keys.tolist(), states.tolist()):
+            self.port.send(Message("note_on" if state else "note_off", note=key + self.settings["note_offset"],
+                                   velocity=self.settings["midi_velocity"]))
+
+    def close(self, pressed: np.ndarray) -> None:
+        """Release keys that are still held, so no note hangs, and close the port."""
+        self.emit(0, np.flatnonzero(pressed), np.zeros(pressed.sum(), dtype=bool))
+        self.port.close()
+
+
+class FileOutput:
+    """Append note events to a MIDI file that is saved periodically while the stream runs."""
+
+    def __init__(self, path: Path, fps: float, settings: dict[str, any]) -> None:
+        self.path = path
+        self.settings = settings
+        self.track = MidiTrack()
+        self.midi = MidiFile(type=0)
+        self.midi.tracks.append(self.track)
+        self.track.append(Message("program_change", program=0, time=0))
+
+        # Same timing as convert_to_midi, counted in source frames
+        self.ticks = mido.second2tick(1 / fps, self.midi.ticks_per_beat, 500000)
+        self.last = -1
+        self.saved = time.perf_counter()
+
+    def emit(self, index: int, keys: np.ndarray, states: np.ndarray) -> None:
+        frames = np.full(len(keys), index)
+        self.last = append_note_events(self.track, frames, keys, states, self.ticks, self.last, self.settings)
+
+        if time.perf_counter() - self.saved > SAVE_INTERVAL:
+            self.save()
+
+    def save(self) -> None:
+        self.midi.save(self.path)
+        self.saved = time.perf_counter()
+
+    def close(self, pressed: np.ndarray) -> None:
+        self.save()
+        logging.info(f"MIDI '{os.path.basename(self.path)}' saved ({len(self.track) - 1} messages)")
+
+
+def get_latency_stats(latencies: list[float], processed: int, dropped: int) -> dict[str, any]:
+    """Summarize capture-to-emit latencies in milliseconds."""
+    latencies = np.array(latencies or [0]) * 1000
+    return {
+        "frames": processed,
+        "dropped": dropped,
+        "mean_ms": float(latencies.mean()),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "max_ms": float(latencies.max()),
+    }
+
+
+def run_live(
+    capture: LatestFrame,
+    settings: dict[str, any],
+    output: PortOutput | FileOutput,
+    roi: bool = True,
+) -> dict[str, any]:
+    """Detect the keyboard on the first usable frame, then emit note events for every frame as it arrives."""
+    keys = None
+    region = None
+    previous = np.zeros(88, dtype=bool)
+    latencies = []
+    processed = 0
+    reported = time.perf_counter()
+    window = 0
+
+    try:
+        # Loop over the newest frames
+        while (item := capture.get()) is not None:
+            index, captured, frame = item
+
+            # Retry key detection until the whole keyboard is visible
+            if keys is None:
+                found = search_keys(frame, settings)
+                if get_key_count(found) != 88:
+                    if index >= DETECT_ATTEMPTS:
+                        raise ValueError(f"Found {get_key_count(found)}/88 keys in the first {index + 1} frames")
+                    continue
+
+                region = get_key_region(found, capture.dim) if roi else None
+                keys = prepare_keys(found, region)
+                logging.info(f"Keyboard detected on frame {index}")
+
+            state = analyse_frame(keys, prepare_frame(frame, region), settings)
+            changed = np.flatnonzero(state != previous)
+            if len(changed):
+                output.emit(index, changed, state[changed])
+            previous = state
+
+            latencies.append(time.perf_counter() - captured)
+            processed += 1
+
+            # Log latencies since the last report
+            if time.perf_counter() - reported > REPORT_INTERVAL:
+                stats = get_latency_stats(latencies[window:], processed, capture.dropped)
+                logging.info(f"{processed} frames, {stats['dropped']} dropped, "
+                             f"latency p50 {stats['p50_ms']:.1f} ms, p95 {stats['p95_ms']:.1f} ms")
+                reported = time.perf_counter()
+                window = len(latencies)
+    finally:
+        capture.stop()
+        output.close(previous)
+
+    return get_latency_stats(latencies, processed, capture.dropped)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Transcribe a live piano video stream into MIDI")
+    parser.add_argument("source", help="capture device index, stream URL or video file")
+    parser.add_argument("-s", "--settings", type=Path, required=True, help="JSON settings file")
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument("-p", "--port", help="MIDI output port name")
+    output.add_argument("-o", "--output", type=Path, help="MIDI file to append events to")
+    parser.add_argument("--realtime", action="store_true", help="play video files back at their frame rate")
+    parser.add_argument("--no-drop", action="store_true",
+                        help="wait for analysis instead of dropping frames (for offline sources)")
+    parser.add_argument("--no-roi", action="store_true", help="analyse full frames instead of the keyboard band")
+    parser.add_argument("-v", "--verbose", action="store_true", help="enable debug logging")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+    settings = load_settings(args.settings)
+    source = int(args.source) if args.source.isdigit() else args.source
+    capture = LatestFrame(source, args.realtime, not args.no_drop)
+
+    if args.port:
+        output = PortOutput(args.port, settings)
+    else:
+        output = FileOutput(args.output, capture.fps, settings)
+
+    try:
+        stats = run_live(capture, settings, output, not args.no_roi)
+    except KeyboardInterrupt:
+        return
+
+    logging.info(f"{stats['frames']} frames analysed, {stats['dropped']} dropped")
+    logging.info(f"Latency: mean {stats['mean_ms']:.1f} ms, p50 {stats['p50_ms']:.1f} ms, "
+                 f"p95 {stats['p95_ms']:.1f} ms, max {stats['max_ms']:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+import os
+import cv2
+import time
+import queue
+import logging
+import multiprocessing
+import numpy as np
+from pathlib import Path
+from typing import Iterator
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+
+from cv import analyse_frame, analyse_frames, crop_frame, get_props, open_video, prepare_frame, probe_frame
+from profiling import disable, enable, get_profiler, profiled
+
+RING_SLOTS_PER_WORKER = 2
+WORKER_TIMEOUT = 1
+
+
+def split_frames(length: int, workers: int) -> list[tuple[int, int]]:
+    """Split a frame count into contiguous (start, stop) ranges, one per worker."""
+    workers = max(1, min(workers, length))
+    size, rest = divmod(length, workers)
+    ranges = []
+    start = 0
+
+    # Spread the remainder over the first ranges
+    for i in range(workers):
+        stop = start + size + (1 if i < rest else 0)
+        ranges.append((start, stop))
+        start = stop
+
+    return ranges
+
+
+def seek_video(video: cv2.VideoCapture, start: int) -> None:
+    """Move a capture to a frame index, decoding forward if seeking is inaccurate."""
+    if start == 0:
+        return
+
+    video.set(cv2.CAP_PROP_POS_FRAMES, start)
+
+    # Some codecs land on the previous keyframe, so fall back to grabbing from the start
+    if int(video.get(cv2.CAP_PROP_POS_FRAMES)) != start:
+        logging.debug(f"Inaccurate seek to frame {start}, grabbing instead")
+        video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        for _ in range(start):
+            video.grab()
+
+
+def iter_range(
+    video: cv2.VideoCapture,
+    count: int = None,
+    region: tuple[int, int, int, int] = None,
+    scale: float = 1,
+) -> Iterator[any]:
+    """Yield up to count frames (or all remaining frames) from an opened capture."""
+    frame_num = 0
+    profiler = get_profiler()
+
+    # The last range reads until the end, as frame counts can be inaccurate
+    while count is None or frame_num < count:
+        start = time.perf_counter() if profiler else None
+        ret, frame = video.read()
+        if profiler:
+            profiler.record("decode", start)
+        if not ret:
+            break
+
+        frame_num += 1
+        yield prepare_frame(frame, region, scale)
+
+
+def analyse_range(
+    path: Path,
+    start: int,
+    stop: int,
+    keys: dict[str, tuple[int, int, int, int]],
+    settings: dict[str, any],
+    region: tuple[int, int, int, int] = None,
+    skip_tolerance: int = None,
+    scale: float = 1,
+    profile: bool = False,
+) -> tuple[np.ndarray, dict[str, any]]:
+    """Open the video in a worker, seek to a frame range and analyse it into a key-state matrix, plus the worker's
+    profiling data if profiling is on."""
+    # Forked workers inherit a copy of the parent's profiler, so each range starts a fresh one
+    if profile:
+        enable()
+    video = cv2.VideoCapture(path)
+    seek_video(video, start)
+    frames = iter_range(video, stop - start if stop is not None else None, region, scale)
+    piece = analyse_frames(keys, frames, settings, length=stop - start if stop is not None else 1,
+                           skip_tolerance=skip_tolerance)
+
+    video.release()
+    logging.debug(f"Frames {start}-{start + len(piece)} analysed")
+    return piece, disable().get_data() if profile else None
+
+
+@profiled("analyse_video")
+def analyse_video(
+    path: Path,
+    keys: dict[str, tuple[int, int, int, int]],
+    settings: dict[str, any],
+    workers: int = None,
+    region: tuple[int, int, int, int] = None,
+    skip_tolerance: int = None,
+    scale: float = 1,
+) -> np.ndarray:
+    """Analyse a video on several processes and merge the key states in frame order."""
+    workers = workers or os.cpu_count()
+    ranges = split_frames(int(get_props(path)["length"]), workers)
+    logging.info(f"Analysing {len(ranges)} frame ranges on {workers} workers")
+
+    # Open-ended last range
+    ranges[-1] = (ranges[-1][0], None)
+    starts = [start for start, _ in ranges]
+    stops = [stop for _, stop in ranges]
+
+    profiler = get_profiler()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(analyse_range, [path] * len(ranges), starts, stops,
+                               [keys] * len(ranges), [settings] * len(ranges), [region] * len(ranges),
+                               [skip_tolerance] * len(ranges), [scale] * len(ranges),
+                               [profiler is not None] * len(ranges))
+
+        # Frame states are independent, so concatenating in order equals the serial result
+        piece = []
+        for (start, stop), (chunk, data) in zip(ranges, results):
+            if stop is not None and len(chunk) != stop - start:
+                logging.warning(f"Frame range {start}-{stop} returned {len(chunk)} frames")
+            if data:
+                profiler.merge(data)
+            piece.append(chunk)
+
+    return np.concatenate(piece)
+
+
+def analyse_slots(
+    name: str,
+    shape: tuple[int, ...],
+    slots: int,
+    filled: multiprocessing.Queue,
+    done: multiprocessing.Queue,
+    keys: dict[str, tuple[int, int, int, int]],
+    settings: dict[str, any],
+    points: tuple[np.ndarray, np.ndarray, np.ndarray] = None,
+    profile: bool = False,
+) -> None:
+    """Analyse frames in place in ring buffer slots until a stop marker arrives (worker process)."""
+    if profile:
+        enable()
+    memory = shared_memory.SharedMemory(name=name)
+    ring = np.ndarray((slots, *shape), dtype=np.uint8, buffer=memory.buf)
+
+    try:
+        # Loop over filled slots
+        while (item := filled.get()) is not None:
+            slot, index = item
+            if points is not None:  # Sample points only
+                pressed = probe_frame(points, ring[slot], settings)
+            else:
+                pressed = analyse_frame(keys, ring[slot], settings)
+
+            # Hand the slot back together with the result
+            done.put((slot, index, pressed))
+
+        # The profile is sent after the last slot, marked by a missing slot number
+        if profile:
+            done.put((None, os.getpid(), disable().get_data()))
+    finally:
+        del ring
+        memory.close()
+
+
+def read_into(
+    video: cv2.VideoCapture,
+    slot: np.ndarray,
+    buffer: np.ndarray,
+    region: tuple[int, int, int, int] = None,
+    scale: float = 1,
+) -> bool:
+    """Decode the next frame into a ring slot, directly if it needs neither cropping nor resizing."""
+    target = slot if not region and scale == 1 else buffer
+    ret, frame = video.read(target)
+    if not ret:
+        return False
+
+    # The decoder only writes in place if the buffer already has the frame's shape
+    if frame is not target and not np.shares_memory(frame, target):
+        target = frame
+    if target is slot:
+        return True
+
+    if region:
+        target = crop_frame(target, region)
+    if scale != 1:
+        cv2.resize(target, None, slot, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    else:
+        np.copyto(slot, target)
+    return True
+
+
+def receive(done: multiprocessing.Queue, processes: list[multiprocessing.Process]) -> tuple[int, int, np.ndarray]:
+    """Wait for the next analysed slot, failing if a worker died."""
+    while True:
+        try:
+            return done.get(timeout=WORKER_TIMEOUT)
+        except queue.Empty:
+            if any(process.exitcode not in (None, 0) for process in processes):
+                raise RuntimeError("An analysis worker exited unexpectedly")
+
+
+def store_row(piece: np.ndarray, index: int, pressed: np.ndarray) -> np.ndarray:
+    """Store the key states of a frame, growing the matrix if the frame count was too low."""
+    if index >= len(piece):
+        piece = np.concatenate([piece, np.zeros((max(len(piece), index + 1 - len(piece)), piece.shape[1]), dtype=bool)])
+
+    piece[index] = pressed
+    return piece
+
+
+@profiled("analyse_pipeline")
+def analyse_pipeline(
+    path: Path,
+    keys: dict[str, tuple[int, int, int, int]],
+    settings: dict[str, any],
+    workers: int = None,
+    region: tuple[int, int, int, int] = None,
+    scale: float = 1,
+    points: tuple[np.ndarray, np.ndarray, np.ndarray] = None,
+    slots: int = None,
+) -> np.ndarray:
+    """Decode into a shared-memory ring buffer on this process while worker processes analyse the filled slots."""
+    workers = workers or os.cpu_count()
+    slots = slots or RING_SLOTS_PER_WORKER * workers
+    video, props = open_video(path)
+
+    # The first frame fixes the slot shape
+    ret, buffer = video.read()
+    if not ret:
+        video.release()
+        raise ValueError(f"No frames in '{os.path.basename(path)}'")
+    first = prepare_frame(buffer, region, scale)
+
+    memory = shared_memory.SharedMemory(create=True, size=slots * first.nbytes)
+    ring = np.ndarray((slots, *first.shape), dtype=np.uint8, buffer=memory.buf)
+    context = multiprocessing.get_context()
+    filled, done = context.Queue(), context.Queue()
+    profiler = get_profiler()
+    processes = [context.Process(target=analyse_slots, daemon=True,
+                                 args=(memory.name, first.shape, slots, filled, done, keys, settings, points,
+                                       profiler is not None))
+                 for _ in range(workers)]
+    logging.info(f"Analysing with 1 decoder and {workers} workers over {slots} shared slots")
+
+    piece = np.zeros((max(1, int(props["length"])), len(keys)), dtype=bool)
+    free = list(range(slots))
+    reports = workers if profiler else 0
+    pending = 0
+    count = 0
+
+    try:
+        for process in processes:
+            process.start()
+
+        # Loop over decoded frames
+        while True:
+            # Backpressure: wait for a worker to hand back a slot while the ring is full
+            while not free:
+                slot, index, pressed = receive(done, processes)
+                piece = store_row(piece, index, pressed)
+                free.append(slot)
+                pending -= 1
+
+            slot = free.pop()
+            start = time.perf_counter() if profiler else None
+            if count == 0:
+                np.copyto(ring[slot], first)
+            elif not read_into(video, ring[slot], buffer, region, scale):
+                break
+            if profiler:
+                profiler.record("decode", start)
+
+            filled.put((slot, count))
+            pending += 1
+            count += 1
+
+        # Stop the workers once all slots are analysed
+        for _ in processes:
+            filled.put(None)
+        while pending or reports:
+            slot, index, pressed = receive(done, processes)
+            if slot is None:  # Profile of a stopped worker
+                profiler.merge(pressed)
+                reports -= 1
+                continue
+
+            piece = store_row(piece, index, pressed)
+            pending -= 1
+    finally:
+        video.release()
+        for process in processes:
+            process.join(timeout=WORKER_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+        del ring
+        memory.close()
+        memory.unlink()
+
+    logging.debug(f"{count} frames decoded into shared slots")
+    return piece[:count]
@@ -0,0 +1,165 @@
+import os
+import sys
+import json
+import time
+import logging
+import resource
+import threading
+import functools
+import numpy as np
+from pathlib import Path
+from typing import Callable
+
+MAX_TRACE_EVENTS = 200000
+
+_profiler = None
+
+
+def get_peak_rss() -> float:
+    """Return the peak resident set size of the process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Reported in bytes on macOS and in KB elsewhere
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+class Profiler:
+    """Collects wall times of pipeline stages and per-frame steps, plus memory high-water marks."""
+
+    def __init__(self, max_events: int = MAX_TRACE_EVENTS) -> None:
+        self.origin = time.perf_counter()
+        self.max_events = max_events
+        self.pid = os.getpid()
+        self.events = []
+        self.durations = {}
+        self.peak_rss = {}
+        self.worker_rss = {}
+
+    def record(self, name: str, start: float, end: float = None) -> None:
+        """Record a span that started at a perf_counter timestamp and ends now (or at end)."""
+        end = end if end is not None else time.perf_counter()
+        self.durations.setdefault(name, []).append(end - start)
+
+        # Aggregates are always kept, trace events only up to a limit
+        if len(self.events) < self.max_events:
+            self.events.append((name, start, end - start, self.pid, threading.get_ident()))
+
+    def record_memory(self, name: str) -> None:
+        """Remember the memory high-water mark reached by the end of a stage."""
+        self.peak_rss[name] = max(self.peak_rss.get(name, 0), get_peak_rss())
+
+    def get_data(self) -> dict[str, any]:
+        """Return everything collected, so a worker process can hand it to the parent."""
+        return {"pid": self.pid, "events": self.events, "durations": self.durations, "peak_rss": self.peak_rss,
+                "total_rss": get_peak_rss()}
+
+    def merge(self, data: dict[str, any]) -> None:
+        """Add what a worker process collected (perf_counter timestamps are shared between processes)."""
+        for name, durations in data["durations"].items():
+            self.durations.setdefault(name, []).extend(durations)
+        for name, peak in data["peak_rss"].items():
+            self.peak_rss[name] = max(self.peak_rss.get(name, 0), peak)
+
+        self.worker_rss[data["pid"]] = max(self.worker_rss.get(data["pid"], 0), data["total_rss"])
+        self.events.extend(data["events"][:self.max_events - len(self.events)])
+
+    def get_summary(self) -> list[dict[str, any]]:
+        """Aggregate call counts, throughput and latency percentiles per stage."""
+        rows = []
+
+        # Loop over stages in order of first appearance
+        for name, durations in self.durations.items():
+            durations = np.array(durations)
+            total = durations.sum()
+            rows.append({
+                "name": name,
+                "calls": len(durations),
+                "total_s": float(total),
+                "per_s": len(durations) / total if total else None,
+                "mean_ms": float(durations.mean() * 1000),
+                "p50_ms": float(np.percentile(durations, 50) * 1000),
+                "p95_ms": float(np.percentile(durations, 95) * 1000),
+                "p99_ms": float(np.percentile(durations, 99) * 1000),
+                "max_ms": float(durations.max() * 1000),
+                "peak_rss_mb": self.peak_rss.get(name),
+            })
+
+        return rows
+
+    def format_summary(self) -> str:
+        """Format the summary as a plain-text table."""
+        lines = [f"{'stage':<20}{'calls':>8}{'total s':>10}{'calls/s':>10}{'mean ms':>10}{'p50 ms':>10}"
+                 f"{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'RSS MB':>10}"]
+
+        # Loop over stages
+        for row in self.get_summary():
+            per_s = f"{row['per_s']:.1f}" if row["per_s"] else "-"
+            rss = f"{row['peak_rss_mb']:.0f}" if row["peak_rss_mb"] else "-"
+            lines.append(f"{row['name']:<20}{row['calls']:>8}{row['total_s']:>10.3f}{per_s:>10}"
+                         f"{row['mean_ms']:>10.3f}{row['p50_ms']:>10.3f}{row['p95_ms']:>10.3f}"
+                         f"{row['p99_ms']:>10.3f}{row['max_ms']:>10.3f}{rss:>10}")
+
+        lines.append(f"Peak RSS: {get_peak_rss():.0f} MB")
+        if self.worker_rss:
+            lines[-1] += f" (workers: up to {max(self.worker_rss.values()):.0f} MB each, {len(self.worker_rss)} workers)"
+        return "\n".join(lines)
+
+    def export_trace(self, path: Path) -> None:
+        """Write all recorded spans as a Chrome trace (also readable by Perfetto), one track per process and thread."""
+        events = [{
+            "name": name,
+            "cat": "pipeline",
+            "ph": "X",
+            "ts": (start - self.origin) * 1e6,
+            "dur": duration * 1e6,
+            "pid": pid,
+            "tid": tid,
+        } for name, start, duration, pid, tid in self.events]
+
+        with open(path, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+        if len(self.events) == self.max_events:
+            logging.warning(f"Trace truncated to the first {self.max_events} events")
+        logging.info(f"Trace '{os.path.basename(path)}' saved ({len(events)} events)")
+
+
+def enable() -> Profiler:
+    """Start collecting profiling data in this process."""
+    global _profiler
+    _profiler = Profiler()
+    return _profiler
+
+
+def disable() -> Profiler:
+    """Stop collecting profiling data and return what was collected."""
+    global _profiler
+    profiler, _profiler = _profiler, None
+    return profiler
+
+
+def get_profiler() -> Profiler:
+    """Return the active profiler, or None when profiling is off."""
+    return _profiler
+
+
+def profiled(name: str) -> Callable:
+    """Decorate a pipeline stage, so its calls are timed while profiling is on."""
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args: any, **kwargs: any) -> any:
+            # Only a global lookup when profiling is off
+            if _profiler is None:
+                return func(*args, **kwargs)
+
+            profiler = _profiler
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profiler.record(name, start)
+                profiler.record_memory(name)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,467 @@
+import os
+import cv2
+import json
+import time
+import heapq
+import logging
+import argparse
+import threading
+import numpy as np
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from cache import DEFAULT_CACHE_DIR, DecodeCache
+from calibrate import CALIBRATED_KEYS, KEYBOARD_BAND, calibrate_video
+from cli import VIDEO_EXTENSIONS, convert_job, load_settings
+from cv import get_props
+
+DEFAULT_PORT = 8765
+DEFAULT_MEMORY = 8 * 2 ** 30
+SCAN_INTERVAL = 2
+REPORT_INTERVAL = 60
+MAX_ATTEMPTS = 3
+FRAME_BUFFERS = 16
+TEMPLATE_SIZE = (32, 8)
+TEMPLATE_DISTANCE = 24
+METRICS_FILE = "metrics.jsonl"
+
+
+def get_template_signature(path: Path) -> dict[str, any]:
+    """Describe the look of a video's keyboard as its frame size plus a perceptual hash of the keyboard band."""
+    video = cv2.VideoCapture(path)
+    width, height = int(video.get(cv2.CAP_PROP_FRAME_WIDTH)), int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    # The middle of the video, as recordings often fade in
+    video.set(cv2.CAP_PROP_POS_FRAMES, int(video.get(cv2.CAP_PROP_FRAME_COUNT)) // 2)
+    ret, frame = video.read()
+    video.release()
+    if not ret:
+        raise ValueError(f"Could not read a frame of '{os.path.basename(path)}'")
+
+    # Average hash: a few pressed keys only flip a few bits
+    band = cv2.cvtColor(frame[int(height * (1 - KEYBOARD_BAND)):], cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(band, TEMPLATE_SIZE, interpolation=cv2.INTER_AREA)
+    bits = np.packbits(small > small.mean())
+    return {"dim": [width, height], "hash": bits.tobytes().hex()}
+
+
+def get_distance(first: str, second: str) -> int:
+    """Count the differing bits of two hex hashes."""
+    return (int(first, 16) ^ int(second, 16)).bit_count()
+
+
+class TemplateStore:
+    """Calibrated settings and key frames of earlier videos, found again for videos that look the same."""
+
+    def __init__(self, root: Path = DEFAULT_CACHE_DIR) -> None:
+        self.root = Path(root) / "templates"
+        os.makedirs(self.root, exist_ok=True)
+
+    def find(self, signature: dict[str, any]) -> dict[str, any]:
+        """Return the closest stored template of the same frame size, or None if none is close enough."""
+        best = None
+
+        # Loop over stored templates
+        for path in self.root.glob("*.json"):
+            with open(path) as file:
+                template = json.load(file)
+            if template["dim"] != signature["dim"]:
+                continue
+
+            distance = get_distance(template["hash"], signature["hash"])
+            if distance <= TEMPLATE_DISTANCE and (best is None or distance < best[0]):
+                best = (distance, template)
+
+        if best is None:
+            return None
+
+        settings = best[1]["settings"]
+        for key in ["white_color", "black_color"]:
+            settings[key] = tuple(settings[key])
+        return best[1]
+
+    def add(self, signature: dict[str, any], settings: dict[str, any], key_frame: int, video: Path) -> None:
+        """Store the calibrated settings of a video under its signature."""
+        settings = {key: settings[key] for key in CALIBRATED_KEYS}
+        template = {**signature, "settings": settings, "key_frame": key_frame, "video": os.path.basename(video)}
+
+        # Write to a temporary file first, as several workers may store templates at once
+        path = self.root / f"{signature['dim'][0]}x{signature['dim'][1]}-{signature['hash']}.json"
+        part = path.with_suffix(f".{os.getpid()}.part")
+        with open(part, "w") as file:
+            json.dump(template, file)
+        os.replace(part, path)
+
+
+def get_job_memory(path: Path) -> int:
+    """Estimate the peak memory of a conversion from the frame size and frame count."""
+    props = get_props(path)
+    width, height = props["dim"]
+
+    # Frames held by decoding and calibration, plus 88 key states per frame
+    return int(width * height * 3 * FRAME_BUFFERS + 88 * max(0, props["length"]))
+
+
+def run_job(
+    video: Path,
+    midi: Path,
+    settings: dict[str, any],
+    cache: DecodeCache = None,
+    options: dict[str, any] = None,
+) -> dict[str, any]:
+    """Convert a video with the settings of a matching template, calibrating and storing a new one otherwise (worker)."""
+    root = cache.root if cache else DEFAULT_CACHE_DIR
+    store = TemplateStore(root)
+    signature = get_template_signature(video)
+    template = store.find(signature)
+    result = None
+
+    if template:
+        try:
+            result = convert_job(video, midi, {**settings, **template["settings"]}, template["key_frame"], cache=cache,
+                                 **(options or {}))
+            result["template"] = "reused"
+        except ValueError as error:
+            logging.warning(f"Template of '{template['video']}' does not fit '{video.name}' ({error}), calibrating")
+
+    if result is None:
+        settings, key_frame = calibrate_video(video, settings, workers=1, root=root)
+        result = convert_job(video, midi, settings, key_frame, cache=cache, **(options or {}))
+        store.add(signature, settings, key_frame, video)
+        result["template"] = "calibrated"
+
+    result["pid"] = os.getpid()
+    return result
+
+
+class Service:
+    """Convert videos from a watched directory and an HTTP API on a persistent process pool, by priority."""
+
+    def __init__(
+        self,
+        watch: Path,
+        output: Path,
+        settings: dict[str, any],
+        jobs: int = 1,
+        memory: int = DEFAULT_MEMORY,
+        cache: DecodeCache = None,
+        options: dict[str, any] = None,
+    ) -> None:
+        self.watch = watch
+        self.output = output
+        self.settings = settings
+        self.jobs = jobs
+        self.memory = memory
+        self.cache = cache
+        self.options = options or {}
+        self.lock = threading.Lock()
+        self.queue = []
+        self.running = {}
+        self.known = set()
+        self.failures = {}
+        self.sizes = {}
+        self.count = 0
+        self.converted = 0
+        self.failed = 0
+        self.started = time.time()
+        self.stopped = threading.Event()
+        os.makedirs(self.output, exist_ok=True)
+
+        # Workers stay alive between jobs, so imports happen once per worker
+        self.executor = ProcessPoolExecutor(max_workers=jobs)
+
+    def submit(self, video: Path, priority: int = 0) -> bool:
+        """Queue a video unless it is already queued or running; higher priorities run first."""
+        video = Path(video).resolve()
+        with self.lock:
+            if video in self.known:
+                return False
+            self.known.add(video)
+
+        job = {"video": video, "priority": priority, "queued": time.time(), "attempts": 0}
+        try:
+            job["memory"] = get_job_memory(video)
+        except Exception as error:
+            with self.lock:
+                self.finish(job, error=error)
+            return False
+
+        with self.lock:
+            # Equal priorities run in submission order
+            heapq.heappush(self.queue, (-priority, self.count, job))
+            self.count += 1
+
+        logging.info(f"'{video.name}' queued with priority {priority}")
+        return True
+
+    def get_midi(self, video: Path) -> Path:
+        return self.output / (video.stem + ".mid")
+
+    def scan(self) -> None:
+        """Queue new videos of the watched directory once their size stopped changing."""
+        sizes = {}
+
+        # Loop over videos in the watched directory
+        for path in sorted(self.watch.iterdir()):
+            if path.suffix.lower() not in VIDEO_EXTENSIONS or path.resolve() in self.known:
+                continue
+
+            # Videos can be deleted or renamed while scanning, or be dangling links
+            try:
+                stat = path.stat()
+                # Skip videos converted before a restart
+                midi = self.get_midi(path)
+                if midi.exists() and midi.stat().st_mtime >= stat.st_mtime:
+                    continue
+            except OSError as error:
+                logging.debug(f"'{path.name}' skipped: {error}")
+                continue
+            # Failed videos are only retried once they change (or through the API)
+            if self.failures.get(path.resolve()) == stat.st_mtime_ns:
+                continue
+
+            sizes[path] = stat.st_size
+            # Files that are still being copied keep growing
+            if sizes[path] and self.sizes.get(path) == sizes[path]:
+                self.submit(path)
+
+        self.sizes = sizes
+
+    def get_memory(self) -> int:
+        return sum(job["memory"] for job in self.running.values())
+
+    def start_jobs(self) -> None:
+        """Start queued jobs while workers are free and their estimated memory fits the budget."""
+        with self.lock:
+            while True:
+                if not self.queue or len(self.running) >= self.jobs:
+                    return
+                job = self.queue[0][2]
+
+                # Jobs suspected of crashing a worker run alone, so a repeated crash can be blamed on them
+                if self.running and (job.get("suspect") or any(other.get("suspect") for other in self.running.values())):
+                    return
+                # A job larger than the whole budget runs alone
+                if self.running and self.get_memory() + job["memory"] > self.memory:
+                    return
+                if job["memory"] > self.memory:
+                    logging.warning(f"'{job['video'].name}' needs about {job['memory'] / 2 ** 30:.2f} GB, "
+                                    f"more than the budget of {self.memory / 2 ** 30:.2f} GB")
+
+                heapq.heappop(self.queue)
+                job["attempts"] += 1
+                # The queue time ends at the first start, crashed runs are part of the total time
+                job.setdefault("start", time.time())
+                future = self.executor.submit(run_job, job["video"], self.get_midi(job["video"]), self.settings,
+                                              self.cache, self.options)
+                self.running[future] = job
+
+    def finish(self, job: dict[str, any], result: dict[str, any] = None, error: Exception = None) -> None:
+        """Count a finished job and append its metrics record."""
+        end = time.time()
+        record = {
+            "video": str(job["video"]),
+            "status": "failed" if error else "converted",
+            "priority": job["priority"],
+            "attempts": job["attempts"],
+            "memory_estimate": job.get("memory"),
+            "queued_seconds": job.get("start", end) - job["queued"],
+            "total_seconds": end - job["queued"],
+            **(result or {}),
+        }
+        if error:
+            record["error"] = str(error)
+            self.failed += 1
+            try:
+                self.failures[job["video"]] = job["video"].stat().st_mtime_ns
+            except OSError:
+                self.failures[job["video"]] = None
+            logging.error(f"'{job['video'].name}' failed: {error}")
+        else:
+            self.converted += 1
+
+        self.known.discard(job["video"])
+        try:
+            with open(self.output / METRICS_FILE, "a") as file:
+                file.write(json.dumps(record) + "\n")
+        except OSError as error:
+            logging.error(f"Metrics of '{job['video'].name}' not saved: {error}")
+
+    def collect(self, timeout: float) -> None:
+        """Wait up to timeout for running jobs and handle the finished ones."""
+        if not self.running:
+            self.stopped.wait(timeout)
+            return
+
+        done, _ = wait(list(self.running), timeout=timeout, return_when=FIRST_COMPLETED)
+        crashed = []
+
+        # Loop over finished jobs
+        for future in done:
+            with self.lock:
+                job = self.running.pop(future)
+                try:
+                    self.finish(job, future.result())
+                except BrokenProcessPool:
+                    crashed.append(job)
+                except Exception as error:
+                    self.finish(job, error=error)
+
+        # A crashed worker breaks the whole pool, so all of its jobs start over on a new one
+        if crashed:
+            with self.lock:
+                crashed += self.running.values()
+                self.running.clear()
+
+                # Loop over jobs of the broken pool
+                for job in crashed:
+                    # The crashing job is unknown unless it ran alone, so the others don't use up an attempt
+                    if len(crashed) > 1:
+                        job["attempts"] -= 1
+                        job["suspect"] = True
+                    self.requeue(job)
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = ProcessPoolExecutor(max_workers=self.jobs)
+            logging.warning("A worker crashed, worker pool restarted")
+
+    def requeue(self, job: dict[str, any]) -> None:
+        """Queue a job of a crashed pool again, unless it already crashed a worker too often on its own."""
+        if job["attempts"] >= MAX_ATTEMPTS:
+            self.finish(job, error=RuntimeError(f"Worker crashed {job['attempts']} times"))
+        else:
+            heapq.heappush(self.queue, (-job["priority"], self.count, job))
+            self.count += 1
+            logging.warning(f"'{job['video'].name}' requeued after a worker crash")
+
+    def get_status(self) -> dict[str, any]:
+        """Summarize the queue and the throughput since the start."""
+        with self.lock:
+            hours = (time.time() - self.started) / 3600
+            return {
+                "queued": [str(job["video"]) for _, _, job in sorted(self.queue)],
+                "running": [str(job["video"]) for job in self.running.values()],
+                "converted": self.converted,
+                "failed": self.failed,
+                "memory_used": self.get_memory(),
+                "memory_budget": self.memory,
+                "uptime_seconds": hours * 3600,
+                "videos_per_hour": self.converted / hours if hours else 0.0,
+            }
+
+    def run(self) -> None:
+        """Scan, start and collect jobs until stopped."""
+        logging.info(f"Watching '{self.watch}' with {self.jobs} workers")
+        reported = time.time()
+
+        try:
+            while not self.stopped.is_set():
+                # A briefly unreachable share must not stop the service, the next scan tries again
+                try:
+                    self.scan()
+                except OSError as error:
+                    logging.error(f"Scanning '{self.watch}' failed: {error}")
+                self.start_jobs()
+                try:
+                    self.collect(SCAN_INTERVAL)
+                except OSError as error:
+                    logging.error(f"Collecting finished jobs failed: {error}")
+                    self.stopped.wait(SCAN_INTERVAL)
+
+                if time.time() - reported > REPORT_INTERVAL:
+                    status = self.get_status()
+                    logging.info(f"{status['converted']} converted, {status['failed']} failed, "
+                                 f"{len(status['queued'])} queued, {status['videos_per_hour']:.1f} videos/hour")
+                    reported = time.time()
+        finally:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """Local HTTP API: GET /status, POST /jobs with {"video": path, "priority": number}."""
+
+    def send_json(self, code: int, body: dict[str, any]) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        if self.path == "/status":
+            self.send_json(200, self.server.service.get_status())
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def do_POST(self) -> None:
+        if self.path != "/jobs":
+            self.send_json(404, {"error": "not found"})
+            return
+
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            video, priority = Path(body["video"]), int(body.get("priority", 0))
+        except (ValueError, KeyError, TypeError) as error:
+            self.send_json(400, {"error": f"invalid job: {error}"})
+            return
+
+        if not video.is_file():
+            self.send_json(404, {"error": f"video '{video}' not found"})
+        elif self.server.service.submit(video, priority):
+            self.send_json(202, {"queued": str(video.resolve()), "priority": priority})
+        else:
+            self.send_json(409, {"error": f"video '{video}' is already queued or running"})
+
+    def log_message(self, format: str, *args: any) -> None:
+        logging.debug(f"HTTP {self.address_string()}: {format % args}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Convert piano videos dropped into a directory as a long-running service")
+    parser.add_argument("watch", type=Path, help="directory to watch for new videos")
+    parser.add_argument("-s", "--settings", type=Path, required=True, help="JSON settings file")
+    parser.add_argument("-o", "--output", type=Path, help="output directory for MIDI and metrics (default: watch)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="persistent worker processes")
+    parser.add_argument("--memory", type=float, default=DEFAULT_MEMORY / 2 ** 30,
+                        help="estimated memory budget of all running jobs in GB")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="local HTTP API port (0 to disable)")
+    parser.add_argument("--cache-dir", type=Path, help="cache directory for decoded frames and templates")
+    parser.add_argument("--scale", type=float, default=1, help="downscale factor applied right after decoding")
+    parser.add_argument("--probe", action="store_true", help="test a small grid of sample points per key")
+    parser.add_argument("-v", "--verbose", action="store_true", help="enable debug logging")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+    settings = load_settings(args.settings)
+    cache = DecodeCache(args.cache_dir) if args.cache_dir else None
+    service = Service(args.watch, args.output or args.watch, settings, args.jobs, int(args.memory * 2 ** 30), cache,
+                      {"scale": args.scale, "probe": args.probe})
+
+    # Serve the API next to the scheduling loop
+    server = None
+    if args.port:
+        server = ThreadingHTTPServer(("127.0.0.1", args.port), ServiceHandler)
+        server.service = service
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logging.info(f"API listening on http://127.0.0.1:{args.port}")
+
+    try:
+        service.run()
+    except KeyboardInterrupt:
+        service.stop()
+    finally:
+        if server:
+            server.shutdown()
+
+    status = service.get_status()
+    logging.info(f"{status['converted']} videos converted, {status['failed']} failed "
+                 f"({status['videos_per_hour']:.1f} videos/hour)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import cv2
+import logging
+from bisect import bisect_right
+from pathlib import Path
+from collections import OrderedDict
+from typing import Callable, Iterator
+
+from cv import iter_frames, open_video
+
+DEFAULT_CACHE_BYTES = 512 * 2 ** 20
+GRAB_LIMIT = 30
+SEEK_PROBES = 4
+# OpenCV seeks this many frames before the target and decodes forward from the keyframe there
+SEEK_DELTA = 16
+
+
+def get_keyframes(path: Path, check: Callable[[], None] = None) -> list[int]:
+    """Index the keyframes of a video by reading its raw packets, without decoding any frame."""
+    video = cv2.VideoCapture(str(path), cv2.CAP_FFMPEG, [cv2.CAP_PROP_FORMAT, -1])
+    keyframes = []
+    index = 0
+
+    # Loop over packets
+    while video.isOpened():
+        if check:
+            check()
+        ret, _ = video.read()
+        if not ret:
+            break
+        if video.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+            keyframes.append(index)
+        index += 1
+
+    video.release()
+    return keyframes
+
+
+class FrameSource:
+    """Lazily decoded, seekable frames of a video with an LRU cache of recently viewed frames."""
+
+    def __init__(
+        self,
+        path: Path,
+        cache_bytes: int = DEFAULT_CACHE_BYTES,
+        keyframes: bool = False,
+        check: Callable[[], None] = None,
+    ) -> None:
+        self.path = path
+        self.video, self.props = open_video(path)
+        self.length = int(self.props["length"])
+        self.position = 0
+
+        self.cache = OrderedDict()
+        self.cache_bytes = cache_bytes
+        self.cached_bytes = 0
+
+        # The check callback raises to abort opening (e.g. when the user cancels)
+        try:
+            self.seekable = self.build_index(check)
+            # Without a keyframe index, jumps further than GRAB_LIMIT frames seek
+            self.keyframes = get_keyframes(path, check) if keyframes and self.seekable else []
+        except BaseException:
+            self.video.release()
+            raise
+        logging.debug(f"Frame source opened ({self.length} frames, seekable: {self.seekable})")
+
+    def build_index(self, check: Callable[[], None] = None) -> bool:
+        """Probe frame-accurate seeking across the video and verify the real frame count."""
+        seekable = True
+
+        # Seek to a few positions spread over the video
+        for i in range(1, SEEK_PROBES + 1):
+            if check:
+                check()
+            target = self.length * i // (SEEK_PROBES + 1)
+            self.video.set(cv2.CAP_PROP_POS_FRAMES, target)
+            if int(self.video.get(cv2.CAP_PROP_POS_FRAMES)) != target:
+                seekable = False
+                break
+
+        # Reported frame counts can overshoot, so step back to the last decodable frame
+        if seekable:
+            while self.length > 0:
+                if check:
+                    check()
+                self.video.set(cv2.CAP_PROP_POS_FRAMES, self.length - 1)
+                if self.video.grab():
+                    break
+                self.length -= 1
+
+        self.video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        self.position = 0
+        return seekable
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, idx: int) -> any:
+        """Return a frame, decoding it on demand if it is not cached."""
+        if not 0 <= idx < self.length:
+            raise IndexError(f"Frame {idx} out of range")
+
+        if idx in self.cache:
+            self.cache.move_to_end(idx)
+            return self.cache[idx]
+
+        frame = self.decode(idx)
+        self.store(idx, frame)
+        return frame
+
+    def __iter__(self) -> Iterator[any]:
+        """Stream all frames through a separate capture, bypassing the cache."""
+        return iter_frames(self.path)
+
+    def get_seek_start(self, idx: int) -> int:
+        """Return the first frame that seeking to a frame decodes, according to the keyframe index."""
+        return self.keyframes[max(0, bisect_right(self.keyframes, max(0, idx - SEEK_DELTA)) - 1)]
+
+    def is_grab_faster(self, idx: int) -> bool:
+        """Check whether grabbing forward to a frame decodes fewer frames than seeking to it."""
+        if self.keyframes:
+            return self.position < idx and self.get_seek_start(idx) <= self.position
+        return self.position < idx <= self.position + GRAB_LIMIT
+
+    def skips_frames(self, stride: int) -> bool:
+        """Check whether reading every stride-th frame seeks past frames instead of decoding all of them."""
+        if self.keyframes:
+            return any(self.get_seek_start(i) > i - stride + 1 for i in range(stride, self.length, stride))
+        return self.seekable and stride > GRAB_LIMIT
+
+    def decode(self, idx: int) -> any:
+        """Decode a single frame, grabbing forward unless seeking skips decoding frames."""
+        if self.is_grab_faster(idx):  # Close ahead
+            while self.position < idx:
+                self.video.grab()
+                self.position += 1
+        elif idx != self.position:
+            if self.seekable:  # Jump directly
+                self.video.set(cv2.CAP_PROP_POS_FRAMES, idx)
+            else:  # Decode forward from the start
+                self.video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                for _ in range(idx):
+                    self.video.grab()
+            self.position = idx
+
+        ret, frame = self.video.read()
+        if not ret:
+            raise IndexError(f"Frame {idx} could not be decoded")
+
+        self.position += 1
+        return frame
+
+    def store(self, idx: int, frame: any) -> None:
+        """Cache a frame and evict the least recently used ones above the memory cap."""
+        self.cache[idx] = frame
+        self.cached_bytes += frame.nbytes
+
+        while self.cached_bytes > self.cache_bytes and len(self.cache) > 1:
+            _, evicted = self.cache.popitem(last=False)
+            self.cached_bytes -= evicted.nbytes
+
+    def release(self) -> None:
+        """Close the capture and drop all cached frames."""
+        self.video.release()
+        self.cache.clear()
+        self.cached_bytes = 0
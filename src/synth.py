@@ -0,0 +1,161 @@
+import cv2
+import logging
+import numpy as np
+from pathlib import Path
+
+from cv import convert_to_midi, get_key_dict
+
+WHITE_COLOR = (255, 255, 255)
+BLACK_COLOR = (10, 10, 10)
+PRESSED_COLOR = (128, 128, 128)
+BACKGROUND_COLOR = (90, 60, 30)
+
+KEYBOARD_HEIGHT = 0.2
+BLACK_KEY_WIDTH = 0.6
+BLACK_KEY_HEIGHT = 0.6
+LEAD_IN = 1.0
+NOTE_LENGTH = (0.15, 1.0)
+
+
+def get_synth_settings(
+    white_color: tuple[int, int, int] = WHITE_COLOR,
+    black_color: tuple[int, int, int] = BLACK_COLOR,
+    pressed_color: tuple[int, int, int] = PRESSED_COLOR,
+) -> dict[str, any]:
+    """Return detection settings (BGR colors) that match a rendered synthetic video."""
+    return {
+        "white_color": white_color,
+        "black_color": black_color,
+        "pressed_color": pressed_color,
+        "white_threshold": 0.25,
+        "black_threshold": 1.0,
+        "pressed_threshold": 0.3,
+        "min_area_pixel": 50,
+        # Weighted by 3 channels, so about half of a key must be pressed
+        "min_area_percent": 1.5,
+        "midi_velocity": 64,
+        "note_offset": 21,
+    }
+
+
+def get_layout(width: int, height: int) -> list[tuple[int, int, int, int, bool]]:
+    """Place 52 white and 36 black keys along the bottom of the frame in A0..C8 order."""
+    top = int(height * (1 - KEYBOARD_HEIGHT))
+    white_width = width / 52
+    white_index = 0
+    layout = []
+
+    # Loop over keys
+    for note in get_key_dict(None).keys():
+        if "#" in note:  # Black key centered on the gap between two white keys
+            w = int(white_width * BLACK_KEY_WIDTH)
+            x = int(white_index * white_width - w / 2)
+            layout.append((x, top, w, int((height - top) * BLACK_KEY_HEIGHT), True))
+        else:  # White key with a small gap on both sides
+            x = int(white_index * white_width)
+            layout.append((x + 2, top, int(white_width) - 4, height - top - 1, False))
+            white_index += 1
+
+    return layout
+
+
+def generate_notes(frames: int, fps: float, density: float, seed: int = 0) -> np.ndarray:
+    """Generate a random frames x 88 ground-truth key-state matrix with about density notes per second."""
+    rng = np.random.default_rng(seed)
+    truth = np.zeros((frames, 88), dtype=bool)
+    start = int(LEAD_IN * fps)
+    count = int(density * max(0, frames - start) / fps)
+
+    # Loop over notes
+    for _ in range(count):
+        key = rng.integers(88)
+        onset = int(rng.integers(start, max(start + 1, frames)))
+        length = max(2, int(rng.uniform(*NOTE_LENGTH) * fps))
+
+        # Keep a gap of two frames to other notes of the same key, so they stay separate notes
+        if not truth[max(0, onset - 2):onset + length + 2, key].any():
+            truth[onset:onset + length, key] = True
+
+    return truth
+
+
+def render_frame(
+    layout: list[tuple[int, int, int, int, bool]],
+    pressed: np.ndarray,
+    upcoming: np.ndarray,
+    width: int,
+    height: int,
+    colors: dict[str, tuple[int, int, int]],
+) -> np.ndarray:
+    """Draw falling notes and the keyboard for one frame."""
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    frame[:] = colors["background"]
+    top = layout[0][1]
+
+    # Falling notes above the keyboard, reaching it when the key is pressed
+    for key, distance in zip(*np.nonzero(upcoming)):
+        x, _, w, _, _ = layout[key]
+        bottom = top - 1 - distance * 4
+        if bottom > 0:
+            frame[max(0, bottom - 40):bottom, x:x + w] = colors["pressed"]
+
+    # White keys first, black keys on top
+    for black in [False, True]:
+        for key, (x, y, w, h, is_black) in enumerate(layout):
+            if is_black == black:
+                if pressed[key]:
+                    frame[y:y + h, max(0, x):x + w] = colors["pressed"]
+                else:
+                    frame[y:y + h, max(0, x):x + w] = colors["black" if black else "white"]
+
+    return frame
+
+
+def render_video(
+    path: Path,
+    width: int = 1280,
+    height: int = 720,
+    fps: float = 30,
+    duration: float = 10,
+    density: float = 4,
+    quality: int = None,
+    seed: int = 0,
+    white_color: tuple[int, int, int] = WHITE_COLOR,
+    black_color: tuple[int, int, int] = BLACK_COLOR,
+    pressed_color: tuple[int, int, int] = PRESSED_COLOR,
+    background_color: tuple[int, int, int] = BACKGROUND_COLOR,
+) -> np.ndarray:
+    """Render a Synthesia-style video and return its ground-truth key-state matrix."""
+    frames = int(duration * fps)
+    truth = generate_notes(frames, fps, density, seed)
+    layout = get_layout(width, height)
+    colors = {"white": white_color, "black": black_color, "pressed": pressed_color, "background": background_color}
+    lookahead = 40
+
+    video = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+
+    # Loop over frames
+    for i in range(frames):
+        # Upcoming onsets within the lookahead, by distance in frames
+        window = truth[i + 1:i + 1 + lookahead]
+        onsets = window & ~np.vstack([truth[i:i + 1], window[:-1]])
+        upcoming = np.zeros((88, lookahead), dtype=bool)
+        upcoming[:, :len(onsets)] = onsets.T
+
+        frame = render_frame(layout, truth[i], upcoming, width, height, colors)
+
+        # Simulate compression artifacts
+        if quality:
+            frame = cv2.imdecode(cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])[1],
+                                 cv2.IMREAD_COLOR)
+
+        video.write(frame)
+
+    video.release()
+    logging.info(f"Synthetic video '{Path(path).name}' rendered ({frames} frames, {truth.sum()} pressed states)")
+    return truth
+
+
+def write_truth(truth: np.ndarray, fps: float, path: Path, settings: dict[str, any]) -> None:
+    """Write the ground truth as a MIDI file."""
+    convert_to_midi(truth, {"fps": fps}, path, settings)
@@ -0,0 +1,152 @@
+import os
+import csv
+import json
+import mido
+import logging
+import numpy as np
+from pathlib import Path
+from typing import Iterable
+from mido import Message, MidiFile, MidiTrack
+
+from cv import append_note_events, get_key_dict, get_note_events, iter_chunks
+from profiling import profiled
+
+NOTE_NAMES = list(get_key_dict(None).keys())
+
+
+class Timeline:
+    """Note intervals (key, onset frame, offset frame) sorted by key and onset, with a search index for time queries."""
+
+    def __init__(self, keys: np.ndarray, onsets: np.ndarray, offsets: np.ndarray, fps: float, length: int) -> None:
+        order = np.lexsort((onsets, keys))
+        self.keys = np.asarray(keys, dtype=np.int64)[order]
+        self.onsets = np.asarray(onsets, dtype=np.int64)[order]
+        self.offsets = np.asarray(offsets, dtype=np.int64)[order]
+        self.fps = fps
+        self.length = length
+
+        # Notes of one key never overlap, so onsets and offsets are both sorted within a key
+        self.stride = length + 1
+        self.onset_index = self.keys * self.stride + self.onsets
+        self.offset_index = self.keys * self.stride + self.offsets
+
+    @classmethod
+    @profiled("build_timeline")
+    def from_piece(cls, piece: Iterable[np.ndarray], fps: float) -> "Timeline":
+        """Run-length encode a key-state matrix (or stream of rows) chunk by chunk into note intervals."""
+        ons, offs = [], []
+        previous = None
+        length = 0
+
+        # Loop over chunks of the piece
+        for chunk in iter_chunks(piece):
+            frames, keys, states = get_note_events(chunk, previous)
+            ons.append(np.stack([keys[states], frames[states] + length]))
+            offs.append(np.stack([keys[~states], frames[~states] + length]))
+
+            previous = chunk[-1].copy()
+            length += len(chunk)
+
+        # Notes still held at the end last until the end
+        if previous is not None and previous.any():
+            held = np.flatnonzero(previous)
+            offs.append(np.stack([held, np.full(len(held), length)]))
+
+        ons = np.concatenate(ons, axis=1) if ons else np.zeros((2, 0), dtype=np.int64)
+        offs = np.concatenate(offs, axis=1) if offs else np.zeros((2, 0), dtype=np.int64)
+
+        # The n-th onset of a key belongs to its n-th offset
+        ons = ons[:, np.lexsort((ons[1], ons[0]))]
+        offs = offs[:, np.lexsort((offs[1], offs[0]))]
+        timeline = cls(ons[0], ons[1], offs[1], fps, length)
+        logging.debug(f"Timeline built ({len(timeline)} notes, {length} frames)")
+        return timeline
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def get_frame(self, seconds: float) -> int:
+        """Convert a time into a frame index within the piece."""
+        return min(max(0, int(seconds * self.fps)), self.length)
+
+    def notes_at(self, seconds: float) -> np.ndarray:
+        """Return the indices of all notes that are down at a point in time."""
+        if not len(self):
+            return np.zeros(0, dtype=np.int64)
+
+        frame = self.get_frame(seconds)
+        keys = np.arange(88)
+
+        # Latest onset at or before the frame, per key
+        idx = np.searchsorted(self.onset_index, keys * self.stride + frame, side="right") - 1
+        valid = idx >= 0
+        idx = np.where(valid, idx, 0)
+        valid &= (self.keys[idx] == keys) & (self.offsets[idx] > frame)
+        return idx[valid]
+
+    def notes_between(self, start: float, stop: float) -> np.ndarray:
+        """Return the indices of all notes that are down at some point of a time range (both ends included)."""
+        first, last = self.get_frame(start), self.get_frame(stop)
+        keys = np.arange(88)
+
+        # Per key, from the first note ending after the start to the last note starting at or before the stop
+        low = np.searchsorted(self.offset_index, keys * self.stride + first, side="right")
+        high = np.searchsorted(self.onset_index, keys * self.stride + last, side="right")
+        ranges = [np.arange(lo, hi) for lo, hi in zip(low.tolist(), high.tolist()) if hi > lo]
+        return np.concatenate(ranges) if ranges else np.zeros(0, dtype=np.int64)
+
+    def get_events(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Return note events as (frame, key, state) arrays in frame, then key order, like get_note_events."""
+        # Notes held at the end are never released
+        closed = self.offsets < self.length
+        frames = np.concatenate([self.onsets, self.offsets[closed]])
+        keys = np.concatenate([self.keys, self.keys[closed]])
+        states = np.concatenate([np.ones(len(self), dtype=bool), np.zeros(np.count_nonzero(closed), dtype=bool)])
+
+        order = np.lexsort((keys, frames))
+        return frames[order], keys[order], states[order]
+
+    def get_rows(self, settings: dict[str, any]) -> list[dict[str, any]]:
+        """Describe every note in onset order with MIDI number, name and times."""
+        order = np.lexsort((self.keys, self.onsets))
+        return [{
+            "note": key + settings["note_offset"],
+            "name": NOTE_NAMES[key],
+            "onset": onset / self.fps,
+            "offset": offset / self.fps,
+            "onset_frame": onset,
+            "offset_frame": offset,
+        } for key, onset, offset in zip(self.keys[order].tolist(), self.onsets[order].tolist(),
+                                        self.offsets[order].tolist())]
+
+    @profiled("write_midi")
+    def write_midi(self, path: Path, settings: dict[str, any]) -> None:
+        """Write the notes as a MIDI file (the same as convert_to_midi on the key-state matrix)."""
+        track = MidiTrack()
+        midi = MidiFile(type=0)
+        midi.tracks.append(track)
+        track.append(Message("program_change", program=0, time=0))
+
+        ticks = mido.second2tick(1 / self.fps, midi.ticks_per_beat, 500000)
+        frames, keys, states = self.get_events()
+        # The first event is delayed by one frame more than the following ones
+        append_note_events(track, frames, keys, states, ticks, -1, settings)
+
+        midi.save(path)
+        logging.info(f"MIDI '{os.path.basename(path)}' saved ({len(frames)} messages)")
+
+    def write_csv(self, path: Path, settings: dict[str, any]) -> None:
+        """Write one row per note."""
+        with open(path, "w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=["note", "name", "onset", "offset", "onset_frame", "offset_frame"])
+            writer.writeheader()
+            writer.writerows(self.get_rows(settings))
+
+        logging.info(f"CSV '{os.path.basename(path)}' saved ({len(self)} notes)")
+
+    def write_json(self, path: Path, settings: dict[str, any]) -> None:
+        """Write the notes with the frame rate and length of the piece."""
+        with open(path, "w") as file:
+            json.dump({"fps": self.fps, "frames": self.length, "notes": self.get_rows(settings)}, file)
+
+        logging.info(f"JSON '{os.path.basename(path)}' saved ({len(self)} notes)")
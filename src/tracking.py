@@ -0,0 +1,194 @@
+import cv2
+import logging
+import numpy as np
+from itertools import combinations
+from typing import Callable, Iterable, Iterator
+
+from cv import analyse_frame, crop_frame, get_key_count, get_key_region, scale_settings, search_keys
+
+TRACK_INTERVAL = 10
+SEARCH_MARGIN = 40
+MIN_MATCH = 0.5
+MATCH_WIDTH = 960
+PATCH_CENTERS = [0.1, 0.23, 0.37, 0.5, 0.63, 0.77, 0.9]
+PATCH_WIDTH = 0.12
+MAX_RESIDUAL = 0.25
+WHITE_KEYS = 52
+
+
+def transform_keys(
+    keys: dict[str, tuple[int, int, int, int]],
+    origin: tuple[int, int],
+    scale: float,
+    shift: tuple[float, float],
+) -> dict[str, tuple[int, int, int, int]]:
+    """Scale key boxes around an origin and move them by a shift."""
+    ox, oy = origin
+    dx, dy = shift
+    moved = {}
+
+    # Loop over keys
+    for note, (x, y, w, h) in keys.items():
+        if w * h > 0:  # Detected key
+            moved[note] = (round(ox + dx + (x - ox) * scale), round(oy + dy + (y - oy) * scale),
+                           max(1, round(w * scale)), max(1, round(h * scale)))
+        else:  # Placeholder
+            moved[note] = (0, 0, 0, 0)
+
+    return moved
+
+
+def get_match_image(frame: any, scale: float) -> any:
+    """Convert a frame (or part of it) into a small edge image of the key borders used for matching."""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    if scale != 1:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    gray = cv2.GaussianBlur(gray, (3, 3), 0)
+
+    # Key borders stay in place whether a key is pressed or not, unlike its fill color
+    return cv2.convertScaleAbs(cv2.Sobel(gray, cv2.CV_16S, 1, 0))
+
+
+class LayoutTracker:
+    """Follow a drifting or zooming keyboard by matching a template of it near its last position."""
+
+    def __init__(
+        self,
+        keys: dict[str, tuple[int, int, int, int]],
+        frame: any,
+        settings: dict[str, any],
+        interval: int = TRACK_INTERVAL,
+        margin: int = SEARCH_MARGIN,
+        min_match: float = MIN_MATCH,
+        scale: float = 1,
+    ) -> None:
+        self.settings = settings
+        # Frames are already downscaled, so key contours are smaller than in full resolution
+        self.detect_settings = scale_settings(settings, scale)
+        self.interval = interval
+        self.margin = margin
+        self.min_match = min_match
+        self.refits = 0
+        self.redetections = 0
+        self.failures = 0
+        self.reset(keys, frame)
+
+    def reset(self, keys: dict[str, tuple[int, int, int, int]], frame: any) -> None:
+        """Take a new reference layout and cut template patches across its keyboard."""
+        self.base = keys
+        self.keys = keys
+        self.region = get_key_region(keys, (frame.shape[1], frame.shape[0]), margin=0)
+        self.scale = 1.0
+        self.shift = (0.0, 0.0)
+
+        # Patches instead of the whole keyboard, so they still fit when the keyboard touches the frame edges
+        x, y, w, h = self.region
+        width = max(8, int(w * PATCH_WIDTH))
+        # Match at most at MATCH_WIDTH pixels across the keyboard
+        self.match_scale = min(1.0, MATCH_WIDTH / w)
+        self.patches = []
+        for center in PATCH_CENTERS:
+            left = min(max(x, int(x + w * center - width / 2)), x + w - width)
+            self.patches.append(((left, y), get_match_image(crop_frame(frame, (left, y, width, h)), self.match_scale)))
+
+    def match(self, frame: any) -> tuple[float, float, tuple[float, float]]:
+        """Search each patch around its expected position and fit zoom and shift to where they were found."""
+        ox, oy = self.region[:2]
+        height, width = frame.shape[:2]
+        bases, found, scores = [], [], []
+
+        # Loop over patches
+        for (px, py), template in self.patches:
+            template = cv2.resize(template, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+            th, tw = template.shape[0] / self.match_scale, template.shape[1] / self.match_scale
+
+            # Search window around the expected position
+            ex = ox + self.shift[0] + (px - ox) * self.scale
+            ey = oy + self.shift[1] + (py - oy) * self.scale
+            left, top = max(0, int(ex) - self.margin), max(0, int(ey) - self.margin)
+            right, bottom = min(width, int(ex + tw) + self.margin), min(height, int(ey + th) + self.margin)
+            window = get_match_image(frame[top:bottom, left:right], self.match_scale)
+            if template.shape[0] > window.shape[0] or template.shape[1] > window.shape[1]:
+                continue
+
+            result = cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED)
+            _, score, _, (mx, my) = cv2.minMaxLoc(result)
+            bases.append((px - ox, py - oy))
+            found.append((left + mx / self.match_scale - ox, top + my / self.match_scale - oy))
+            scores.append(score)
+
+        bases, found, scores = np.array(bases), np.array(found), np.array(scores)
+
+        # Keys repeat along the keyboard, so single patches can lock onto a neighbouring key:
+        # fit through every pair of patches and keep the fit most other patches agree with
+        tolerance = self.region[2] / WHITE_KEYS * MAX_RESIDUAL
+        best = None
+        for i, j in combinations(range(len(found)), 2):
+            if bases[i, 0] == bases[j, 0]:
+                continue
+            scale = (found[j, 0] - found[i, 0]) / (bases[j, 0] - bases[i, 0])
+            inliers = np.abs(bases[:, 0] * scale + found[i, 0] - bases[i, 0] * scale - found[:, 0]) <= tolerance
+            rank = (np.count_nonzero(inliers), scores[inliers].sum())
+            if best is None or rank > best[0]:
+                best = (rank, inliers)
+
+        # A fit only counts if most patches agree with it
+        if best is None or best[0][0] * 2 <= len(self.patches):
+            return -1.0, self.scale, self.shift
+
+        inliers = best[1]
+        bases, found, scores = bases[inliers], found[inliers], scores[inliers]
+        scale, dx = np.polyfit(bases[:, 0], found[:, 0], 1)
+        dy = float(np.mean(found[:, 1] - bases[:, 1] * scale))
+        return float(np.median(scores)), float(scale), (float(dx), dy)
+
+    def update(self, index: int, frame: any) -> dict[str, tuple[int, int, int, int]]:
+        """Return the key layout for a frame, re-fitting it every interval frames."""
+        if index % self.interval:
+            return self.keys
+
+        score, scale, shift = self.match(frame)
+
+        if score >= self.min_match:  # Local re-fit
+            self.scale, self.shift = scale, shift
+            keys = transform_keys(self.base, self.region[:2], scale, shift)
+            if keys != self.keys:
+                self.keys = keys
+                self.refits += 1
+            return self.keys
+
+        # Fall back to a full detection when the template no longer fits
+        keys = search_keys(frame, self.detect_settings)
+        if get_key_count(keys) == 88:
+            self.reset(keys, frame)
+            self.redetections += 1
+            logging.info(f"Keyboard re-detected on frame {index} (match {score:.2f})")
+        else:
+            self.failures += 1
+            logging.warning(f"Keyboard lost on frame {index} (match {score:.2f}), keeping the last layout")
+
+        return self.keys
+
+
+def analyse_tracked(
+    tracker: LayoutTracker,
+    frames: Iterable[any],
+    settings: dict[str, any],
+    progress: Callable[[float], None] = None,
+    length: int = None,
+) -> Iterator[np.ndarray]:
+    """Analyse full frames with a tracked key layout and yield per-frame key-state rows."""
+    # Loop over frames
+    for i, frame in enumerate(frames):
+        yield analyse_frame(tracker.update(i, frame), frame, settings)
+
+        # Update progress every 100 frames
+        if i % 100 == 0:
+            if progress and length:
+                progress(i / length * 100)
+            logging.debug(f"Frame {i} analysed")
+
+    if progress:
+        progress(100)
+    logging.info(f"Key layout re-fitted {tracker.refits} times, re-detected {tracker.redetections} times, "
+                 f"lost {tracker.failures} times")